@@ -0,0 +1,218 @@
+"""
+Access to the annotation database `data/store.db`, shared by the server and data processing scripts
+  - Pooled connections, each used by a single thread at a time (Reused across requests)
+  - WAL journal mode, readers do not block the writer and vice versa
+  - Values are passed as statement parameters (Statements are cached per connection), never formatted into SQL
+"""
+import queue
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+DB_FILE_PATH = Path.joinpath(Path(__file__).parent.resolve(), "store.db")
+
+SENTENCE_TABLE = "Sentence"
+VALID_INSTANCES_TABLE = "PositiveInstance"
+INVALID_INSTANCES_TABLE = "NegativeInstance"
+
+# Work queue of sentences to annotate: unprocessed, not skipped sentences shorter than MAX_SENTENCE_LENGTH
+MAX_SENTENCE_LENGTH = 250
+SENTENCE_LEASE_SECONDS = 600 # Sentence is not served to other annotators for this long
+QUEUE_CONDITION = "processed=0 AND skip=0 AND length(sentence)<{}".format(MAX_SENTENCE_LENGTH)
+
+# Table schemas, formatted with table name (and referenced Sentence table)
+SENTENCE_SCHEMA = ("CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY, sentence TEXT, processed INTEGER, "
+                   "skip INTEGER DEFAULT 0, random_key INTEGER, lease_expiry REAL DEFAULT 0, UNIQUE(sentence))")
+INSTANCE_SCHEMA = ("CREATE TABLE IF NOT EXISTS {} (sentence_id INTEGER REFERENCES {}(id), "
+                   "entity1 TEXT, rel TEXT, entity2 TEXT)")
+
+
+class Database:
+
+    def __init__(self, db_file_path: str = DB_FILE_PATH, max_connections: int = 8, timeout: float = 30.0):
+        """
+        Arguments:
+            db_file_path: SQLite database file
+            max_connections: Maximum number of open connections, further users wait for a free connection
+            timeout: Seconds to wait for a lock held by another connection (or process) before failing
+        """
+        self.db_file_path = str(db_file_path)
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=max_connections) # Most recently used connection first
+        self.num_connections = 0
+        self.max_connections = max_connections
+        self.lock = threading.Lock()
+
+
+    def _connect(self):
+        # Autocommit mode (isolation_level None), transactions are explicit in `transaction`
+        connection = sqlite3.connect(self.db_file_path, timeout=self.timeout, isolation_level=None,
+                                     check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL") # Durable at WAL checkpoints, safe against corruption
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+
+    @contextmanager
+    def connection(self):
+        """
+        Connection from pool for duration of context, statements outside of `transaction` commit individually
+        """
+        connection = None
+        with self.lock:
+            if self.pool.empty() and self.num_connections < self.max_connections:
+                connection = self._connect()
+                self.num_connections += 1
+        if connection is None:
+            connection = self.pool.get()
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction: # Never return a connection with an open transaction
+                connection.rollback()
+            self.pool.put(connection)
+
+
+    @contextmanager
+    def transaction(self):
+        """
+        Connection within a single transaction, committed at end of context or rolled back on exception
+          - Write lock is taken at start (BEGIN IMMEDIATE) such that concurrent writers wait instead of
+            failing on lock upgrade
+        """
+        with self.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+
+    def query(self, sql: str, parameters: Iterable = ()) -> List:
+        # All rows of a single (read) statement
+        with self.connection() as connection:
+            return connection.execute(sql, tuple(parameters)).fetchall()
+
+
+    def checkpoint(self):
+        # Writes WAL contents into the database file, such that the file alone is complete (e.g. for download)
+        with self.connection() as connection:
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+    def lease_sentence(self, lease_seconds: float = SENTENCE_LEASE_SECONDS):
+        """
+        Random sentence of work queue not leased to another annotator, leased for `lease_seconds`
+          - Seek to a random key in partial index of queue (Independent of table size), first sentence at or
+            after the key not currently leased
+          - Selection and lease are a single write transaction, concurrent callers never get the same sentence
+          - Lease ends on expiry, or as sentence is processed / skipped (Leaves the queue)
+        Returns:
+            Sentence, None if queue is empty or all sentences are leased
+        """
+        now = time.time()
+        query = ("SELECT rowid, sentence FROM {} INDEXED BY SentenceQueue WHERE {} AND lease_expiry<? AND random_key{}? "
+                 "ORDER BY random_key LIMIT 1")
+        with self.transaction() as connection:
+            random_key = random.randint(-2 ** 63, 2 ** 63 - 1)
+            row = connection.execute(query.format(SENTENCE_TABLE, QUEUE_CONDITION, ">="), (now, random_key)).fetchone()
+            if row is None: # Wrap around
+                row = connection.execute(query.format(SENTENCE_TABLE, QUEUE_CONDITION, "<"), (now, random_key)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE {} SET lease_expiry=? WHERE rowid=?".format(SENTENCE_TABLE),
+                               (now + lease_seconds, row[0]))
+            return row[1]
+
+
+    def positive_instances(self) -> Iterator[Tuple]:
+        """
+        Positive instances of processed sentences, in order of sentences, in a single query
+        Returns:
+            Generator of (sentence, entity1, rel, entity2), the connection is held until exhausted
+        """
+        with self.connection() as connection:
+            yield from connection.execute("SELECT s.sentence, i.entity1, i.rel, i.entity2 FROM {} AS s "
+                                          "JOIN {} AS i ON i.sentence_id = s.id WHERE s.processed=1 "
+                                          "ORDER BY s.id, i.rowid".format(SENTENCE_TABLE, VALID_INSTANCES_TABLE))
+
+
+    def create_tables(self):
+        """
+        Creates tables (and work queue index) if not present, migrating databases of earlier schemas
+          - Instances reference their sentence by `sentence_id` (Sentence.id)
+          - INTEGER Representation of Boolean values processed and skip: true(1), false(0)
+          - random_key: Random position of sentence in work queue, lease_expiry: Time until which sentence is leased
+        """
+        with self.transaction() as connection:
+            connection.execute(SENTENCE_SCHEMA.format(SENTENCE_TABLE))
+            # Databases created before sentences could be skipped / before work queue
+            columns = [row[1] for row in connection.execute("PRAGMA table_info({})".format(SENTENCE_TABLE))]
+            if "skip" not in columns:
+                connection.execute("ALTER TABLE {} ADD COLUMN skip INTEGER DEFAULT 0".format(SENTENCE_TABLE))
+            if "random_key" not in columns:
+                connection.execute("ALTER TABLE {} ADD COLUMN random_key INTEGER".format(SENTENCE_TABLE))
+                connection.execute("UPDATE {} SET random_key=random()".format(SENTENCE_TABLE))
+            if "lease_expiry" not in columns:
+                connection.execute("ALTER TABLE {} ADD COLUMN lease_expiry REAL DEFAULT 0".format(SENTENCE_TABLE))
+            if "valid_keys" in columns:
+                _migrate_instance_keys(connection)
+
+            for table in (VALID_INSTANCES_TABLE, INVALID_INSTANCES_TABLE):
+                connection.execute(INSTANCE_SCHEMA.format(table, SENTENCE_TABLE))
+                connection.execute("CREATE INDEX IF NOT EXISTS {0}Sentence ON {0} (sentence_id)".format(table))
+            # Every inserted sentence gets a random queue position
+            connection.execute("CREATE TRIGGER IF NOT EXISTS SentenceRandomKey AFTER INSERT ON {0} "
+                               "WHEN NEW.random_key IS NULL BEGIN "
+                               "UPDATE {0} SET random_key=random() WHERE rowid=NEW.rowid; END".format(SENTENCE_TABLE))
+            # Index holds only sentences in the queue, processed / skipped sentences leave it
+            connection.execute("CREATE INDEX IF NOT EXISTS SentenceQueue ON {} (random_key) WHERE {}"
+                               .format(SENTENCE_TABLE, QUEUE_CONDITION))
+
+
+    def close(self):
+        # Closes idle connections of pool
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.num_connections -= 1
+
+
+def _parse_keys(keys) -> List[int]:
+    # Comma joined rowids of earlier schema, single keys are stored as INTEGER
+    return [int(key) for key in str(keys).split(",") if key.strip()] if keys is not None else []
+
+
+def _migrate_instance_keys(connection: sqlite3.Connection):
+    """
+    Migrates databases referencing instances by comma joined rowids (Sentence.valid_keys / invalid_keys)
+      - Sentence table is rebuilt with `id` (Kept equal to rowid) and without key columns
+      - `sentence_id` of instances is set from keys, instances not referenced by any sentence are kept
+        with NULL sentence_id (Replaced by a later annotation of their sentence)
+    """
+    sentence_keys = connection.execute("SELECT rowid, valid_keys, invalid_keys FROM {}".format(SENTENCE_TABLE)).fetchall()
+    connection.execute(SENTENCE_SCHEMA.format("SentenceMigrated"))
+    connection.execute("INSERT INTO SentenceMigrated (id, sentence, processed, skip, random_key, lease_expiry) "
+                       "SELECT rowid, sentence, processed, skip, random_key, lease_expiry FROM {}".format(SENTENCE_TABLE))
+    connection.execute("DROP TABLE {}".format(SENTENCE_TABLE)) # Also drops queue index and trigger, recreated
+    connection.execute("ALTER TABLE SentenceMigrated RENAME TO {}".format(SENTENCE_TABLE))
+
+    for table, keys_column in ((VALID_INSTANCES_TABLE, 1), (INVALID_INSTANCES_TABLE, 2)):
+        columns = [row[1] for row in connection.execute("PRAGMA table_info({})".format(table))]
+        if not columns: # Table not yet created
+            continue
+        if "sentence_id" not in columns:
+            connection.execute("ALTER TABLE {} ADD COLUMN sentence_id INTEGER REFERENCES {}(id)"
+                               .format(table, SENTENCE_TABLE))
+        connection.executemany("UPDATE {} SET sentence_id=? WHERE rowid=?".format(table),
+                               ((row[0], key) for row in sentence_keys for key in _parse_keys(row[keys_column])))
@@ -1,28 +1,18 @@
-import sqlite3
+# Run from root folder: `python -m data.preprocess_google_tagged`
 import json
 from pathlib import Path
-from spacy.lang.en import English
-
-SENTENCE_TABLE = "Sentence"
-
-def quote_string(txt: str):
-    return "\"" + txt + "\""
+from model_implementation.spacy_pipelines import get_pipeline
+from data.database import Database, SENTENCE_TABLE
 
 def process_file(file_path: str):
 
-    nlp = English() # Sentencizer
-    nlp.add_pipe(nlp.create_pipe('sentencizer'))
+    nlp = get_pipeline("sentencizer")
 
-    # Connection to database
-    db_file_path = Path.joinpath(Path(__file__).parent, "store.db")
-    connection = sqlite3.connect(str(db_file_path))
-    cursor = connection.cursor()
-
-    # Create table if not created
-    # INTEGER Representation of Boolean value processed: true(0), false(1)
-    cursor.execute('create table if not exists {} (sentence TEXT, valid_keys STRING, invalid_keys STRING, processed INTEGER, UNIQUE(sentence))'
-                   .format(SENTENCE_TABLE))
+    # Connection to database, create tables if not created
+    database = Database()
+    database.create_tables()
 
+    sentences = []
     with open(file_path, "r") as data_file:
         num_lines_processed = 0
         for line in data_file:
@@ -37,23 +27,19 @@ def process_file(file_path: str):
                 # Certain escape characters, ignore these paragraphs
                 continue
 
-            # Duplicated sentences do exist, REPLACE handles these
-            cursor.execute("INSERT OR REPLACE INTO {} ({}, {}, {}, {}) VALUES ({}, {}, {}, {})"
-                        .format(SENTENCE_TABLE,
-                                "sentence", "valid_keys", "invalid_keys", "processed",
-                                quote_string(sentence),
-                                quote_string(",".join([])), # No instances validated yet
-                                quote_string(",".join([])),
-                                0 # Signify unprocessed sentence
-                                )
-                            )
-    # Due to the format of GoogleTagged sentences, highly unlikely for sentences
-    # beginning with subject pronouns to contain Named Entities
-    cursor.execute("DELETE FROM Sentence WHERE SUBSTR(sentence, 1, 2) = 'He' OR SUBSTR(sentence, 1, 3) = 'She'
-    OR SUBSTR(sentence, 1, 3) = 'His' OR SUBSTR(sentence, 1, 3) = 'Her'")
-
-    connection.commit()
-    connection.close()
+            sentences.append((sentence,))
+
+    # Sentences of file are inserted in a single transaction
+    with database.transaction() as connection:
+        # Duplicated sentences do exist, IGNORE keeps the existing (possibly annotated) sentence
+        # processed 0 signifies unprocessed sentence
+        connection.executemany("INSERT OR IGNORE INTO {} (sentence, processed) VALUES (?, 0)".format(SENTENCE_TABLE),
+                               sentences)
+        # Due to the format of GoogleTagged sentences, highly unlikely for sentences
+        # beginning with subject pronouns to contain Named Entities
+        connection.execute("""DELETE FROM {} WHERE SUBSTR(sentence, 1, 2) = 'He' OR SUBSTR(sentence, 1, 3) = 'She'
+        OR SUBSTR(sentence, 1, 3) = 'His' OR SUBSTR(sentence, 1, 3) = 'Her'""".format(SENTENCE_TABLE))
+    database.close()
 
     return num_lines_processed
 
@@ -1,46 +1,28 @@
+# Run from root folder: `python -m data.process_data`
 import pandas as pd
-# Database
-import sqlite3
-import spacy
 from typing import Tuple, List, Dict
 from pathlib import Path
-from spacy.lang.en import English
-
-SENTENCE_TABLE = "Sentence"
-VALID_INSTANCES_TABLE = "PositiveInstance"
-INVALID_INSTANCES_TABLE = "NegativeInstance"
-
-db_file_path = Path.joinpath(Path(__file__).parent, "store.db")
+from model_implementation.spacy_pipelines import get_pipeline
+# Database
+from data.database import Database
 
 # Spacy
-nlp = English()
-tokenizer = nlp.Defaults.create_tokenizer(nlp)
+tokenizer = get_pipeline().tokenizer
 
 def process_db(instance_file):
     """
     Retrieves the positive and negative instances for each sentence, generates IOB2 tags for positive instances and saves to file
     """
-    connection = sqlite3.connect(str(db_file_path))
-    sentence_cursor = connection.cursor()
-    instance_cursor = connection.cursor()
-
+    database = Database()
     iob_file = open(instance_file, "a+")
 
     NUM_PROCESSED = 0
-    # Select only processed sentence instances
-    sentence_cursor.execute('SELECT * FROM {} WHERE processed=1 AND LENGTH(valid_keys) > 0'.format(SENTENCE_TABLE))
-    for row in sentence_cursor:
-        sentence = row[0]
-        valid_keys = [row[1]] if isinstance(row[1], int) else [int(x) for x in row[1].split(',')]
-        invalid_keys = [row[2]] if isinstance(row[2], int) else [int(x) for x in row[2].split(',')]
-        for key in valid_keys:
-            instance_cursor.execute("SELECT * FROM PositiveInstance WHERE rowid={}".format(key))
-            instance = instance_to_iob(sentence, instance_cursor.fetchone())
-            if not instance == "":
-                NUM_PROCESSED += 1
-                iob_file.write(instance)
-        for key in invalid_keys:
-            instance_cursor.execute("SELECT * FROM NegativeInstance WHERE rowid={}".format(key))
+    for row in database.positive_instances():
+        instance = instance_to_iob(row[0], row[1:])
+        if not instance == "":
+            NUM_PROCESSED += 1
+            iob_file.write(instance)
+    database.close()
 
     print(NUM_PROCESSED)
     iob_file.close()
@@ -111,7 +93,7 @@ def instance_to_iob(sentence: str, instance: Tuple):
         iob_instance: `\n` separated tokens with each row: <word_index>, <token>, <IOB-2 tag>
     """
 
-    nlp = spacy.load('en_core_web_sm')
+    nlp = get_pipeline("tagger") # Shared, loaded once per process
     pos_tags = [token.pos_ for token in nlp(sentence)]
 
     ent1, rel, ent2 = instance[0], instance[1], instance[2]
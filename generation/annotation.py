@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+# Analysis layers of a sentence, as computed by annotators given to `AnnotationCache`
+SPACY_DOC = "spacy_doc" # Tokens, POS, noun chunks and named entities (spacy Doc)
+DEPENDENCY_TREE = "dependency_tree" # Hierplane tree of allen dependency parser
+NER_TOKENS = "ner_tokens" # Tokens with allen NER tags
+OIE_TUPLES = "oie_tuples" # Relation tuples of allen OpenIE
+
+
+class SentenceAnnotation:
+    """
+    Analysis layers of a single sentence, each computed at most once on first use and shared by all extractors
+      - Layers are to be treated as read-only by extractors
+    """
+
+    def __init__(self, sentence: str, annotators: Dict[str, Callable[[str], Any]]):
+        self.sentence = sentence
+        self.annotators = annotators
+        self.layers: Dict = {}
+        self.locks = { layer: threading.Lock() for layer in annotators } # Concurrent extractors wait on the same layer
+
+
+    def get(self, layer: str):
+        with self.locks[layer]:
+            if layer not in self.layers: # Not cached if annotator raises, retried on next call
+                self.layers[layer] = self.annotators[layer](self.sentence)
+            return self.layers[layer]
+
+
+class AnnotationCache:
+    """
+    Least recently used cache of sentence annotations keyed by sentence text
+    """
+
+    def __init__(self, annotators: Dict[str, Callable[[str], Any]], max_size: int = 1024):
+        """
+        Arguments:
+            annotators: Function computing each analysis layer from a raw sentence
+            max_size: Maximum number of sentences annotations are kept for
+        """
+        self.annotators = annotators
+        self.max_size = max_size
+        self.annotations: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get(self, sentence: str) -> SentenceAnnotation:
+        with self.lock:
+            if sentence in self.annotations:
+                self.annotations.move_to_end(sentence)
+            else:
+                self.annotations[sentence] = SentenceAnnotation(sentence, self.annotators)
+                if len(self.annotations) > self.max_size:
+                    self.annotations.popitem(last=False)
+            return self.annotations[sentence]
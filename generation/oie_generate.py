@@ -1,7 +1,8 @@
 from typing import Tuple, List, Iterator, Dict
 from .utils import get_sentences_oie, get_sentences_ent_rel, get_phrase
 from .allen_models import OpenIE, NER
-import spacy
+from .annotation import SentenceAnnotation, NER_TOKENS, OIE_TUPLES
+from model_implementation.spacy_pipelines import get_pipeline
 
 PRINT_OIE_TUPLES = False
 PRINT_SENTENCE = False # Only print for questioning sentence validity
@@ -18,7 +19,7 @@ class DataGenerator:
         self.use_spacy = use_spacy
         self.use_allen = use_allen
         if use_spacy:
-            self.spacy_nlp = spacy.load("en_core_web_sm")
+            self.spacy_nlp = get_pipeline("tagger", "parser", "ner") # Noun chunks (POS and parse) and named entities
         if use_allen:
             self.ner = NER() # Load NER model from allen
 
@@ -29,21 +30,23 @@ class DataGenerator:
         self.sentence = ""
 
 
-    def generate(self, sentence: str):
+    def generate(self, sentence: str, annotation: SentenceAnnotation = None):
         """ Generate BIO tagged instance for a sentence
 
         Args:
             sentence: Raw sentence string
+            annotation: (Optional) Shared annotation of sentence providing allen NER tokens and OIE tuples
         Returns:
             void: Writes directly to file
         """
         self.sentence = sentence
-        self.ent_tagged_sent, self.entities, self.ent_idx_map = self.get_tagged_entities(sentence)
+        self.ent_tagged_sent, self.entities, self.ent_idx_map = self.get_tagged_entities(sentence, annotation)
         if not (list(filter(lambda word: word["ent_type"] is not None, self.ent_tagged_sent))): # If no named entities, skip
             # print("No named entities in sentence")
             return ""
 
-        oie_tuples = self.open_ie.get_tuples(sentence) # Get relational tuples from oie extractor, filtered conditionally
+        # Get relational tuples from oie extractor, filtered conditionally
+        oie_tuples = annotation.get(OIE_TUPLES) if annotation else self.open_ie.get_tuples(sentence)
 
         filtered_rel_tuples = []
         concat_instances = ""
@@ -60,7 +63,7 @@ class DataGenerator:
         return concat_instances, filtered_rel_tuples
 
 
-    def get_tagged_entities(self, sentence: str):
+    def get_tagged_entities(self, sentence: str, annotation: SentenceAnnotation = None):
         """ Retrieves NER tagged entities and tags the given sentence accordingly
         - Tokenization of sentence is basic and does not remove punctuation
         - Spacy
@@ -101,7 +104,7 @@ class DataGenerator:
                 ent_idx_map[entity] = (start, end)
 
         elif self.use_allen:
-            words : List[Dict] = self.ner.get_tagged_tokens(sentence)
+            words : List[Dict] = annotation.get(NER_TOKENS) if annotation else self.ner.get_tagged_tokens(sentence)
             entities, ent_idx_map = self.ner.get_entities(words)
 
         else:
@@ -231,7 +234,7 @@ if __name__ == "__main__":
         file_name = "../data/RE/GoogleTagged/20130403-institution.json"
         for sentence in get_sentences_ent_rel(file_name):
             print(sentence)
-            spacy_nlp = spacy.load("en_core_web_sm")
+            spacy_nlp = get_pipeline("parser") # Sentence boundaries from dependency parse
             doc = spacy_nlp(sentence)
             for sent in doc.sents:
                 instance = generator.generate(sent.string.strip())
@@ -1,6 +1,5 @@
 import re
 from pathlib import Path
-from model_implementation.trainer import Trainer
 
 def get_model_training_config(impl_root: str):
 
@@ -13,8 +12,14 @@ def get_model_training_config(impl_root: str):
     save_path.mkdir(parents=True, exist_ok=True)
     num_epochs_per_save = 5
 
-    # Saved model path for prediction
-    predict_path = Path.joinpath(impl_root, "db_saved/model_epoch5")
+    # Compiled (vectorized) instances of data files
+    cache_dir = Path.joinpath(impl_root.parent.resolve(), "data/generated/cache")
+
+    # Saved model path for prediction (Model save folder for best model of training, else latest model_epoch*)
+    predict_path = Path.joinpath(impl_root, "db_saved")
+
+    # Exported model for serving, see `export_model.py`
+    export_dir = Path.joinpath(impl_root, "exported")
 
     # Custom configurations
     weights_dir = None
@@ -31,6 +36,8 @@ def get_model_training_config(impl_root: str):
         "highway": True,
         "dropout": 0.2, # Irrelevant for now
         "layers": 8,
+        "jit_lstm": False, # TorchScript compiled LSTM time-step loop
+        "inference_precision": "fp32", # "int8" or "bf16" for reduced precision prediction on CPU
         "weights_dir": weights_dir,
         "tokens_dir": tokens_dir,
         "pos_dir": pos_dir,
@@ -38,7 +45,9 @@ def get_model_training_config(impl_root: str):
         "token_embedding_dim": 100,
         "ne_embedding_dim": 50,
         "pos_embedding_dim": 50,
-        "predict_path": predict_path
+        "predict_path": predict_path,
+        "export_dir": export_dir,
+        "serve_exported": False # Serve export of export_dir (if of current model at predict_path) in server.py
     }
 
     training_config = {
@@ -48,7 +57,17 @@ def get_model_training_config(impl_root: str):
         "traindata_file": traindata_file,
         "testdata_file": testdata_file,
         "save_on_epochs": num_epochs_per_save, # Every x number of epochs to save on
-        "save_path": save_path
+        "save_path": save_path,
+        "cache_dir": cache_dir,
+        "bucket_width": 5, # Batch instances within 5 tokens of length of each other
+        "max_tokens": None, # Set to batch by number of padded tokens instead of batch_size
+        "seed": 0,
+        "loader_workers": 2, # Processes preparing batches alongside training
+        "prefetch_batches": 4,
+        "num_workers": 1, # Processes for distributed data-parallel training
+        "resume": False, # Continue from training state in save_path if present (Epoch, optimizer, early stopping)
+        "patience": 10, # Early stopping after epochs without improvement of test F1
+        "early_stopping_metric": "f1"
     }
 
     return model_config, training_config
@@ -76,6 +95,7 @@ sentences = [
              ]
 
 if __name__ == "__main__":
+    from model_implementation.trainer import Trainer # Not imported by users of the configuration only (server.py)
 
     # Implementation root
     impl_root = Path.joinpath(Path(__file__).parent.resolve(), 'model_implementation')
@@ -86,7 +106,6 @@ if __name__ == "__main__":
     if TRAIN:
         trainer.train()
     else:
-        for sentence in sentences:
-            predicted = trainer.predict(sentence)
+        for predicted in trainer.predict_batch(sentences):
             print(predicted)
 
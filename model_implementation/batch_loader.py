@@ -0,0 +1,129 @@
+"""
+Batch tasks, prepared into padded model input (CPU tensors) by `prepare_batch`:
+  - ("compiled", compiled_dir, indexes): Instances at `indexes` of compiled instances in `compiled_dir`
+  - ("raw", tokens_list, tags_list, pos_list): Parsed instances to be vectorized
+"""
+import multiprocessing
+import queue
+import threading
+import numpy as np
+import torch
+from typing import Dict, Iterable, Optional
+from model_implementation.model.utils import Preprocessor
+from model_implementation.data_cache import InstanceCache
+
+# Per worker process state, set by `_init_worker`
+_preprocessor: Optional[Preprocessor] = None
+_instance_caches: Dict = {}
+
+
+def _init_worker(preprocessor: Preprocessor, seed: int):
+    global _preprocessor
+    _preprocessor = preprocessor
+    # Workers are deterministic given their tasks, seeded regardless in case of any random preprocessing
+    worker_id = multiprocessing.current_process()._identity[0] if multiprocessing.current_process()._identity else 0
+    np.random.seed(seed + worker_id)
+    torch.manual_seed(seed + worker_id)
+    torch.set_num_threads(1) # Leave compute cores to the training process
+
+
+def prepare_batch(task, preprocessor: Optional[Preprocessor] = None):
+    """
+    Prepares padded model input for batch task, with preprocessor of worker process if not given
+    Returns:
+        Dictionary of CPU tensors, None if the batch could not be prepared
+    """
+    try:
+        if task[0] == "compiled":
+            _, compiled_dir, indexes = task
+            if compiled_dir not in _instance_caches: # Memory-mapped once per process
+                _instance_caches[compiled_dir] = InstanceCache(compiled_dir)
+            return _instance_caches[compiled_dir].get_batch(indexes)
+        else:
+            _, tokens_list, tags_list, pos_list = task
+            return (preprocessor or _preprocessor).vectorize_batch(tokens_list, tags_list, pos_list)
+    except Exception as e:
+        print("\nException: {}".format(e))
+        return None
+
+
+class BatchLoader:
+    """
+    Prepares batches on `num_workers` worker processes, prefetching up to `prefetch` batches ahead
+    of the training loop through a bounded queue
+      - Tasks are consumed lazily by a producer thread, hence parsing of data files also runs
+        alongside training
+      - Batches are returned in order of tasks, hence deterministic given the task order
+      - With `num_workers` = 0, batches are prepared in the calling thread
+    """
+
+    def __init__(self, preprocessor: Preprocessor, num_workers: int = 0, prefetch: int = 4, seed: int = 0):
+        self.preprocessor = preprocessor
+        self.num_workers = num_workers
+        self.prefetch = max(prefetch, 1)
+        self.pool = multiprocessing.Pool(num_workers, initializer=_init_worker,
+                                         initargs=(preprocessor, seed)) if num_workers > 0 else None
+
+
+    def iterate(self, tasks: Iterable, skip_failed: bool = True):
+        """
+        Generator of prepared batches for tasks (e.g. of one epoch), batches which failed are skipped,
+        or yielded as None if not `skip_failed` (One batch per task)
+        Producer is stopped and outstanding batches discarded if the generator is closed early
+        """
+        if self.pool is None:
+            for task in tasks:
+                batch = prepare_batch(task, self.preprocessor)
+                if batch is not None or not skip_failed:
+                    yield batch
+            return
+
+        pending = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        end_of_tasks = object()
+        producer_errors = [] # Raised in consumer, e.g. errors in parsing of data file
+
+        def produce():
+            try:
+                for task in tasks:
+                    result = self.pool.apply_async(prepare_batch, (task,))
+                    while not stop.is_set():
+                        try:
+                            pending.put(result, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                producer_errors.append(e)
+            finally:
+                pending.put(end_of_tasks) # Consumer either waits for this or has stopped draining
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                result = pending.get()
+                if result is end_of_tasks:
+                    if producer_errors:
+                        raise producer_errors[0]
+                    break
+                batch = result.get()
+                if batch is not None or not skip_failed:
+                    yield batch
+        finally:
+            stop.set()
+            while producer.is_alive(): # Drain so that producer is not blocked on a full queue
+                try:
+                    pending.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            producer.join()
+
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of the CustomLSTM input projection:
+  - per-timestep: `input_linearity` applied to each time-step inside the recurrence (previous implementation)
+  - hoisted: `input_linearity` applied once over the whole padded (batch, time, input) tensor
+
+Usage: `python -m model_implementation.benchmark_lstm` from root folder
+"""
+import time
+import torch
+from torch import Tensor
+from model_implementation.model.h_d_lstm import CustomLSTM
+from model_implementation.model.utils import LSTM_Direction
+
+BATCH_SIZES = [1, 10, 32, 64]
+SEQUENCE_LENGTHS = [10, 30, 60]
+REPEATS = 5
+
+config = {
+    "input_size": 200,
+    "hidden_size": 300,
+    "highway": True,
+    "dropout": 0.2,
+    "direction": LSTM_Direction.forward
+}
+
+
+class PerTimestepProjection:
+    """
+    Stands in for the projected inputs in `CustomLSTM._recurrence`, projecting each time-step slice
+    only when it is indexed, i.e. one small matrix multiplication per time-step
+    """
+    def __init__(self, layer: CustomLSTM, sequence_tensor: Tensor):
+        self.layer = layer
+        self.sequence_tensor = sequence_tensor
+
+    def __getitem__(self, index):
+        return self.layer.input_linearity(self.sequence_tensor[index])
+
+    def size(self):
+        return self.sequence_tensor.size()
+
+    def new_zeros(self, *size):
+        return self.sequence_tensor.new_zeros(*size)
+
+
+def per_timestep(layer: CustomLSTM, sequence_tensor: Tensor, lengths: Tensor):
+    return layer._recurrence(PerTimestepProjection(layer, sequence_tensor), lengths)[0]
+
+
+def hoisted(layer: CustomLSTM, sequence_tensor: Tensor, lengths: Tensor):
+    return layer._recurrence(layer.input_linearity(sequence_tensor), lengths)[0]
+
+
+def time_path(path, layer: CustomLSTM, sequence_tensor: Tensor, lengths: Tensor):
+    with torch.no_grad():
+        path(layer, sequence_tensor, lengths) # Warm up
+        start_time = time.time()
+        for _ in range(REPEATS):
+            path(layer, sequence_tensor, lengths)
+    return (time.time() - start_time) / REPEATS
+
+
+def main():
+    torch.manual_seed(0)
+    layer = CustomLSTM(config)
+    print("| batch | time | per-timestep (ms) | hoisted (ms) | speedup | max abs diff |")
+    for batch_size in BATCH_SIZES:
+        for sequence_length in SEQUENCE_LENGTHS:
+            sequence_tensor = torch.randn(batch_size, sequence_length, config["input_size"])
+            # Decreasing lengths as required by packed sequences, longest sequence spans all time-steps
+            lengths = torch.linspace(sequence_length, max(1, sequence_length // 2), batch_size).long()
+            for i, length in enumerate(lengths):
+                sequence_tensor[i, length:] = 0
+
+            with torch.no_grad():
+                expected = per_timestep(layer, sequence_tensor, lengths)
+                actual = hoisted(layer, sequence_tensor, lengths)
+            max_diff = (expected - actual).abs().max().item()
+
+            per_timestep_time = time_path(per_timestep, layer, sequence_tensor, lengths)
+            hoisted_time = time_path(hoisted, layer, sequence_tensor, lengths)
+            print("| {} | {} | {:.2f} | {:.2f} | {:.2f}x | {:.2e} |".format(
+                batch_size, sequence_length, per_timestep_time * 1000, hoisted_time * 1000,
+                per_timestep_time / hoisted_time, max_diff))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Accuracy regression check of reduced precision inference (see `model/inference.py`) against float32,
+on a held-out file of generated instances:
+  - Precision / Recall / F1 of decoded tags against gold tags for float32 and reduced precision model
+  - Agreement of decoded tags between both models, and time taken
+  - Difference of class probabilities of reduced precision model to float32 model (Maximum and mean absolute)
+
+Fails (exit status 1) if F1 of the reduced precision model drops by more than MAX_F1_DROP, or if its decoded tags
+agree with those of the float32 model on less than MIN_TAG_AGREEMENT of tokens
+
+Usage: `python -m model_implementation.check_inference_precision <instance file> [int8|bf16]` from root folder
+"""
+import sys
+import time
+import torch
+from pathlib import Path
+from main import get_model_training_config
+from model_implementation.trainer import Trainer
+from model_implementation.data_utils import get_next_batch
+from model_implementation.model.inference import get_inference_model
+
+BATCH_SIZE = 64
+MAX_F1_DROP = 0.01
+MIN_TAG_AGREEMENT = 0.95
+
+
+def main(instance_file: str, precision: str):
+    impl_root = Path(__file__).parent.resolve()
+    model_config, _ = get_model_training_config(impl_root)
+    model_config["inference_precision"] = "fp32"
+    trainer = Trainer(model_config)
+    model = trainer._load_predict_model()
+    models = { "fp32": model, precision: get_inference_model(model, precision) }
+
+    confusion_matrices = { name: trainer._new_confusion_matrix().cpu() for name in models }
+    times = { name: 0.0 for name in models }
+    num_tokens, num_agreed = 0, 0
+    max_probability_diff, total_probability_diff = 0.0, 0.0
+    for tokens, tags, pos in get_next_batch(BATCH_SIZE, instance_file):
+        try:
+            model_input = trainer.preprocessor.vectorize_batch(tokens, tags, pos) # CPU tensors
+        except (AssertionError, KeyError) as e: # Mismatched tags or POS not in vocabulary
+            print("\nException: {}".format(e))
+            continue
+        predicted, probabilities = {}, {}
+        for name, model in models.items():
+            start_time = time.time()
+            with torch.no_grad():
+                output = model({ key: value.to(next(model.parameters()).device) if torch.is_tensor(value) else value
+                                 for key, value in model_input.items() })
+            predicted[name] = trainer.decoder.get_tag_indexes(output).cpu()
+            times[name] += time.time() - start_time
+            probabilities[name] = output["class_probabilities"].detach().cpu()
+            trainer._update_confusion_matrix(confusion_matrices[name], model_input["tags_vec"], predicted[name],
+                                             model_input["mask"])
+        valid = model_input["mask"] > 0
+        num_tokens += valid.sum().item()
+        num_agreed += (predicted["fp32"][valid] == predicted[precision][valid]).sum().item()
+        probability_diff = (probabilities["fp32"] - probabilities[precision]).abs()[valid] # (valid tokens, labels)
+        max_probability_diff = max(max_probability_diff, probability_diff.max().item())
+        total_probability_diff += probability_diff.mean(-1).sum().item()
+
+    f1_scores = {}
+    print("| model | precision | recall | F1 | time (s) |")
+    for name in models:
+        precision_score, recall, f1_scores[name] = trainer._get_stats(confusion_matrices[name])
+        print("| {} | {:.4f} | {:.4f} | {:.4f} | {:.2f} |".format(name, precision_score, recall, f1_scores[name], times[name]))
+    tag_agreement = num_agreed / max(num_tokens, 1)
+    print("Tag agreement with fp32: {:.4f} ({} tokens)".format(tag_agreement, num_tokens))
+    print("Class probability difference to fp32: max {:.4f} | mean {:.6f}".format(
+        max_probability_diff, total_probability_diff / max(num_tokens, 1)))
+
+    failed = False
+    f1_drop = f1_scores["fp32"] - f1_scores[precision]
+    if f1_drop > MAX_F1_DROP:
+        print("F1 drop of {:.4f} exceeds {}".format(f1_drop, MAX_F1_DROP))
+        failed = True
+    if tag_agreement < MIN_TAG_AGREEMENT:
+        print("Tag agreement of {:.4f} below {}".format(tag_agreement, MIN_TAG_AGREEMENT))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "int8"))
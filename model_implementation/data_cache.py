@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import shutil
+import numpy as np
+import torch
+from pathlib import Path
+from typing import Dict, List
+from model_implementation.model.utils import Constants, Preprocessor
+from model_implementation.data_utils import parse_generated_instances
+
+# Arrays making up a compiled instance file, tokens/ents/pos/tags are concatenated over all instances
+# and instance i spans [offsets[i], offsets[i + 1])
+CACHE_ARRAYS = ["tokens", "ents", "pos", "tags", "offsets"]
+
+
+def file_hash(file_path: str, chunk_size: int = 1 << 20):
+    # Hash of file contents, read in chunks so that large instance files are not held in memory
+    hasher = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def compile_instances(data_file: str, vocab_files: List[str], preprocessor: Preprocessor, cache_dir: str):
+    """
+    One-time compilation of generated instances (as parsed by `parse_generated_instances`) into int32 arrays
+    of vocabulary indexes, saved as `.npy` files
+      - Keyed by hash of the data file and vocabulary files, recompiled only if any of these change
+    Arguments:
+        data_file: Path to file containing instances
+        vocab_files: Paths to tokens.txt, pos.txt and labels.txt used for vectorization
+        preprocessor: Preprocessor with vocabularies loaded from `vocab_files`
+        cache_dir: Directory containing compiled instance files
+    Returns:
+        Path to directory of compiled arrays
+    """
+    hasher = hashlib.sha1()
+    for source_file in [data_file] + list(vocab_files):
+        hasher.update(file_hash(source_file).encode())
+    compiled_dir = Path(cache_dir, hasher.hexdigest())
+    if compiled_dir.exists():
+        return compiled_dir
+
+    print("Compiling instances of {} to {}".format(data_file, compiled_dir))
+    tokens, ents, pos, tags, offsets = [], [], [], [], [0]
+    num_skipped = 0
+    for instance_tokens, instance_tags, instance_pos in parse_generated_instances(data_file):
+        try:
+            vectorized: Dict = preprocessor.vectorize_token_tags(instance_tokens, instance_tags, instance_pos)[0]
+        except (AssertionError, KeyError): # Mismatched tags, non-string tokens or POS not in vocabulary
+            num_skipped += 1
+            continue
+        tokens.append(vectorized["sent_vec"])
+        ents.append(vectorized["ent_vec"])
+        pos.append(vectorized["pos_vec"])
+        tags.append(vectorized["tags_vec"])
+        offsets.append(offsets[-1] + len(vectorized["sent_vec"]))
+    if num_skipped:
+        logging.log(logging.WARN, "Skipped %d instances which could not be vectorized" % num_skipped)
+
+    # Write to temporary directory first, such that an interrupted compilation is never used
+    partial_dir = Path(cache_dir, hasher.hexdigest() + ".partial")
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    for name, arrays in zip(CACHE_ARRAYS[:-1], [tokens, ents, pos, tags]):
+        concatenated = np.concatenate(arrays) if arrays else np.zeros(0)
+        np.save(str(Path(partial_dir, name + ".npy")), concatenated.astype(np.int32))
+    np.save(str(Path(partial_dir, "offsets.npy")), np.asarray(offsets, dtype=np.int64))
+    shutil.rmtree(str(compiled_dir), ignore_errors=True)
+    partial_dir.rename(compiled_dir)
+    return compiled_dir
+
+
+class InstanceCache:
+    """
+    Compiled instances, memory-mapped from the arrays written by `compile_instances`
+    """
+    def __init__(self, compiled_dir: str):
+        self.compiled_dir = compiled_dir
+        arrays = {name: np.load(str(Path(compiled_dir, name + ".npy")), mmap_mode="r") for name in CACHE_ARRAYS}
+        self.tokens, self.ents, self.pos, self.tags = arrays["tokens"], arrays["ents"], arrays["pos"], arrays["tags"]
+        self.offsets = np.asarray(arrays["offsets"])
+        self.lengths = self.offsets[1:] - self.offsets[:-1]
+
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+    def get_batch(self, indexes: List[int]):
+        """
+        Pads instances at `indexes` to the maximum length of the batch
+        Returns:
+            Dictionary of (CPU) tensors as with `Trainer._preprocess_batch`
+        """
+        indexes = np.asarray(indexes)
+        lengths = self.lengths[indexes]
+        positions = np.arange(lengths.max())
+        mask = positions[None, :] < lengths[:, None] # (batch size, max length)
+        # Index of each padded position within concatenated arrays, padding positions point to the instance start
+        flat_indexes = self.offsets[indexes][:, None] + np.where(mask, positions[None, :], 0)
+
+        def pad(array):
+            return torch.from_numpy(np.where(mask, array[flat_indexes], Constants.PAD_INDEX).astype(np.int64))
+
+        return { "sent_vec": pad(self.tokens),
+                 "ent_vec": pad(self.ents),
+                 "pos_vec": pad(self.pos),
+                 "lengths": lengths.tolist(),
+                 "mask": torch.from_numpy(mask.astype(np.int64)),
+                 "tags_vec": pad(self.tags)
+                 }
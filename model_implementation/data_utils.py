@@ -4,6 +4,9 @@ import pandas as pd
 from typing import Dict, List
 from string import punctuation
 
+# Number of rows read into memory at a time when streaming instance files
+CHUNK_SIZE = 100000
+
 def format_label(label: str):
     # Reformat to IOB-2
     if label == 'O':
@@ -37,7 +40,7 @@ def reorder_argtags(tags: List[str]):
 
             # Replace all ARG-X with ARG-<curr_tag_num>
             reordered_tags.append(tag.replace(str(tag[-1]), str(curr_tag_num)))
-            next_tag = tags[curr_index]
+            next_tag = tags[curr_index] if curr_index < len(tags) else "" # ARG may end the sentence
             while re.search("I-", next_tag): # Search for trailing I-ARG tags
                 next(tags_iter) # Advance iterator
                 reordered_tags.append(next_tag.replace(str(tag[-1]), str(curr_tag_num)))
@@ -52,24 +55,41 @@ def reorder_argtags(tags: List[str]):
     return reordered_tags
 
 
+def stream_sentences(file_path: str, columns: List[str], chunk_size: int = CHUNK_SIZE,
+                     drop_null_words: bool = False, **read_csv_kwargs):
+    """
+    Streams tab separated file `chunk_size` rows at a time (constant memory regardless of file size),
+    grouping rows into sentences, each beginning at a row with word_id == 0
+    Arguments:
+        columns: Columns to retrieve per row, first column has to be `word_id`
+        drop_null_words: Omit rows with empty `word`
+        read_csv_kwargs: Passed to `pd.read_csv`
+    Returns:
+        Generator of sentences, each a list of row tuples with values ordered as in `columns`
+    """
+    sentence = []
+    for chunk in pd.read_csv(file_path, sep="\t", chunksize=chunk_size, **read_csv_kwargs):
+        if drop_null_words:
+            chunk = chunk[pd.notnull(chunk['word'])]
+        for row in zip(*[chunk[column] for column in columns]):
+            if row[0] == 0 and sentence:
+                yield sentence
+                sentence = []
+            sentence.append(row)
+    if sentence: # Last sentence of file
+        yield sentence
+
+
 def parse_oie(file_path: str):
     """
     Get tokens and tags: of format (tab separated columns) as in the OIE-tagged dataset:
     word_id | word | pred | pred_id | head_pred_id | sent_id | run_id | label
         - label: To be formatted to IOB-2 format if not already
     """
-    df = pd.read_csv(file_path, sep="\t")
-    df = df[pd.notnull(df['word'])] # Remove entries containing null
-    tokens, tags = [], []
-    for _, row in df.iterrows():
-        token = row['word']
-        tag = format_label(row['label'])
-        if row["word_id"] == 0:
-            yield tokens, reorder_argtags(tags)
-            tokens, tags = [token], [tag]
-        else:
-            tokens.append(token)
-            tags.append(tag)
+    for sentence in stream_sentences(file_path, ["word_id", "word", "label"], drop_null_words=True):
+        tokens = [word for _, word, _ in sentence]
+        tags = [format_label(label) for _, _, label in sentence]
+        yield tokens, reorder_argtags(tags)
 
 
 def get_next_batch(batch_size: int, data_file: str):
@@ -92,16 +112,9 @@ def parse_generated_instances(file_path: str):
     word_id | word | label
         - label: (B/I - ENT1) | (B/I - REL) | (B/I - ENT2) | O)
     """
-    df = pd.read_csv(file_path, sep="\t", names=["word_id", "word", "label", "pos"], quoting=csv.QUOTE_NONE)
-    tokens, tags, pos = [], [], []
-    for _, row in df.iterrows():
-        token = row['word']
-        tag = row['label']
-        token_pos = row['pos']
-        if row["word_id"] == 0 and tokens and tags:
-            yield tokens, tags, pos
-            tokens, tags, pos = [token], [tag], [token_pos]
-        else:
-            tokens.append(token)
-            tags.append(tag)
-            pos.append(token_pos)
+    columns = ["word_id", "word", "label", "pos"]
+    for sentence in stream_sentences(file_path, columns, names=columns, quoting=csv.QUOTE_NONE):
+        tokens = [word for _, word, _, _ in sentence]
+        tags = [label for _, _, label, _ in sentence]
+        pos = [token_pos for _, _, _, token_pos in sentence]
+        yield tokens, tags, pos
@@ -51,10 +51,14 @@ for i, vector in enumerate(embedding_vectors):
     embedding_matrix[i + 2] = vector
 embedding_tensor = torch.Tensor(embedding_matrix)
 torch.save(embedding_tensor, token_embedder_filepath)
+# Raw float32 copy, memory-mapped by the model (Shared between processes)
+token_embedder_mmap_filepath = Path.joinpath(glove_dir_path, 'token_embedder.npy')
+np.save(token_embedder_mmap_filepath, embedding_matrix.astype(np.float32))
 
 # Move processed files to Custom folder
 shutil.move(token_filepath, Path(tokens_dir, 'tokens.txt'))
 shutil.move(token_embedder_filepath, Path(tokens_dir, 'token_embedder'))
+shutil.move(token_embedder_mmap_filepath, Path(tokens_dir, 'token_embedder.npy'))
 
 # Create save_dir
 save_path = Path.joinpath(impl_dir, "saved")
@@ -0,0 +1,28 @@
+"""
+Exports trained model at `predict_path` (see `main.py`) for serving with `serving.Predictor`
+
+Usage: `python -m model_implementation.export_model [export dir]` from root folder
+  - Defaults to `export_dir` of model configuration
+  - Served by `server.py` only with `serve_exported` of model configuration, and only while the export is of
+    the current model at `predict_path` (Re-export after training), or if no model is present at `predict_path`
+"""
+import sys
+from pathlib import Path
+from main import get_model_training_config
+from model_implementation.trainer import Trainer
+from model_implementation.model.export import export_model
+from model_implementation.model.utils import get_checkpoint_path
+
+
+def main(export_dir=None):
+    impl_root = Path(__file__).parent.resolve()
+    model_config, _ = get_model_training_config(impl_root)
+    export_dir = Path(export_dir) if export_dir else model_config["export_dir"]
+    model_config["inference_precision"] = "fp32"
+    trainer = Trainer(model_config)
+    export_model(trainer._load_predict_model(), model_config, export_dir, checkpoint_path=get_checkpoint_path(model_config["predict_path"]))
+    print("Exported model {} to {}".format(model_config["predict_path"], export_dir))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -1,5 +1,6 @@
+import re
 import torch
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from .utils import *
 
 class Decoder:
@@ -12,21 +13,17 @@ class Decoder:
     def __init__(self, vocab: Vocabulary, labels: Labels):
         self.labels = labels
         self.vocab = vocab
+        self.transition_matrix = self.get_viterbi_pairwise_potentials() # Fixed for labels, compute once
 
 
     def decode(self, output_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
-        all_predictions = output_dict['class_probabilities']
-        sequence_lengths = self.get_lengths_from_binary_sequence_mask(output_dict["mask"]).data.tolist()
+        # Tag indexes of `get_tag_indexes`, cut to sequence lengths and mapped to tags
+        viterbi_paths, sequence_lengths = self.get_tag_indexes(output_dict, with_lengths=True)
 
-        if all_predictions.dim() == 3:
-            predictions_list = [all_predictions[i].detach().cpu() for i in range(all_predictions.size(0))]
-        else:
-            predictions_list = [all_predictions]
         all_tags = []
         all_maxl_seq = []
-        transition_matrix = self.get_viterbi_pairwise_potentials()
-        for predictions, length in zip(predictions_list, sequence_lengths):
-            max_likelihood_sequence, _ = self.viterbi_decode(predictions[:length], transition_matrix)
+        for max_likelihood_sequence, length in zip(viterbi_paths.tolist(), sequence_lengths.tolist()):
+            max_likelihood_sequence = max_likelihood_sequence[:length]
             tags = [self.labels.get_word_from_index(x) for x in max_likelihood_sequence]
             all_tags.append(tags)
             all_maxl_seq.append(max_likelihood_sequence)
@@ -35,6 +32,71 @@ class Decoder:
         return output_dict
 
 
+    def get_tag_indexes(self, output_dict: Dict[str, torch.Tensor], with_lengths: bool = False):
+        """
+        Decodes tag indexes of a batch without leaving the device of the class probabilities
+        Returns:
+            Tensor of shape (batch_size, sequence_length), indexes beyond sequence lengths are not meaningful
+            (And tensor of sequence lengths if `with_lengths`)
+        """
+        all_predictions = output_dict['class_probabilities'].detach()
+        mask = output_dict["mask"]
+        if all_predictions.dim() == 2: # Single sequence
+            all_predictions = all_predictions.unsqueeze(0)
+            mask = mask.view(1, -1)
+        sequence_lengths = self.get_lengths_from_binary_sequence_mask(mask).to(all_predictions.device)
+        transition_matrix = self.transition_matrix.to(all_predictions.device)
+        viterbi_paths = self.batched_viterbi_decode(all_predictions, sequence_lengths, transition_matrix)
+        return (viterbi_paths, sequence_lengths) if with_lengths else viterbi_paths
+
+
+    def batched_viterbi_decode(self, tag_sequences: torch.Tensor, sequence_lengths: torch.Tensor,
+                               transition_matrix: torch.Tensor):
+        """
+        Viterbi decoding of a batch of variable length sequences, equivalent to `viterbi_decode` (without
+        observations) on each sequence, with time-steps processed for all sequences at once
+
+        Parameters
+        ----------
+        tag_sequences : torch.Tensor, required.
+            A tensor of shape (batch_size, sequence_length, num_tags) of scores for each tag.
+        sequence_lengths : torch.Tensor, required.
+            A tensor of shape (batch_size,) of lengths of each sequence.
+        transition_matrix : torch.Tensor, required.
+            A tensor of shape (num_tags, num_tags) representing the binary potentials
+            for transitioning between a given pair of tags.
+
+        Returns
+        -------
+        viterbi_paths : torch.Tensor
+            A tensor of shape (batch_size, sequence_length) of tag indices of the maximum likelihood
+            tag sequences, indices beyond the length of each sequence are not meaningful.
+        """
+        batch_size, sequence_length, num_tags = list(tag_sequences.size())
+
+        # Scores of paths are frozen once a sequence is exhausted, making the final scores those at length - 1
+        path_scores = tag_sequences[:, 0, :]
+        path_indices = []
+        for timestep in range(1, sequence_length):
+            # (batch_size, num_tags [previous], num_tags [current])
+            summed_potentials = path_scores.unsqueeze(-1) + transition_matrix.unsqueeze(0)
+            scores, paths = torch.max(summed_potentials, 1)
+            active = (sequence_lengths > timestep).unsqueeze(-1)
+            path_scores = torch.where(active, tag_sequences[:, timestep, :] + scores, path_scores)
+            path_indices.append(paths)
+
+        # Construct the most likely sequences backwards, the best tag is carried unchanged
+        # through the time-steps beyond the length of each sequence
+        _, best_tags = torch.max(path_scores, -1)
+        viterbi_paths = tag_sequences.new_zeros((batch_size, sequence_length), dtype=torch.long)
+        for timestep in reversed(range(1, sequence_length)):
+            viterbi_paths[:, timestep] = best_tags
+            previous_tags = path_indices[timestep - 1].gather(1, best_tags.unsqueeze(-1)).squeeze(-1)
+            best_tags = torch.where(sequence_lengths > timestep, previous_tags, best_tags)
+        viterbi_paths[:, 0] = best_tags
+        return viterbi_paths
+
+
     def get_viterbi_pairwise_potentials(self):
         """
         Generate a matrix of pairwise transition potentials for the BIO labels.
@@ -164,3 +226,62 @@ class Decoder:
         return mask.long().sum(-1)
 
 
+    def get_relations(self, tokens, tags_list: List[List], vectorized_instances: List[Dict]):
+        """
+        Parses output tags of all instances of a sentence to relation tuples
+        Returns:
+            List of < ent1: str, rel: str, ent2: str > tuples
+        """
+        # Tuples of token indexes
+        rel_tuples: List[Tuple] = self.parse_tags({
+            "tokens": tokens, # For getting tokens with UNK tag
+            "tags_list": tags_list, # Mutiple tag ouputs possible per sentence
+            "vectorized_instances": vectorized_instances
+            })
+
+        rel_tuples_split = [] # Split list of relations per two entities to separate instances
+        for rel_tuple in rel_tuples:
+            rel_tuples_split += [(rel_tuple[0], relation, rel_tuple[2]) for relation in rel_tuple[1]]
+
+        return rel_tuples_split
+
+
+    def parse_tags(self, output_dict: Dict):
+        """
+        Given a vectorized sentence (vocabulary word indexes) and output tags for the sentence,
+        generate tuples of relations
+        Arguments:
+            Dictionary containing "sent_vec": `sentence vector` and "tags_list": `list of tags`
+            Note that tags is a nested list since multiple predicates can be present in the sentence
+        Returns:
+            tuples: List of < ent1: str, rels: List[str], ent2: str > tuples
+              - (multiple rels possible for two entities)
+        """
+        tokens, tags_list, vectorized_instances = output_dict["tokens"], output_dict["tags_list"], output_dict["vectorized_instances"]
+        assert(len(tags_list) == len(vectorized_instances))
+
+        tuples: List[Tuple] = []
+        for n, vectorized_instance in enumerate(vectorized_instances):
+            ent1, rels, ent2 = "", [], ""
+            ent_vector = vectorized_instance['ent_vec']
+            tags = tags_list[n]
+            rel = ""
+            for i, token in enumerate(tokens):
+                if ent_vector[i] == 1:
+                    ent1 = " ".join([ent1, token.text]) if ent1 else token.text
+                elif ent_vector[i] == 2:
+                    ent2 = " ".join([ent2, token.text]) if ent2 else token.text
+                else:
+                    tag = tags[i]
+                    if re.search("B-", tag):
+                        if not rel == "":
+                            rels.append(rel)
+                        rel = token.text
+                    elif re.search("I-", tag):
+                        rel = " ".join([rel, token.text])
+                    else: # O tag
+                        if not rel == "":
+                            rels.append(rel)
+                        rel = ""
+            tuples.append((ent1, rels, ent2))
+        return(tuples)
@@ -0,0 +1,133 @@
+import copy
+import hashlib
+import shutil
+import torch
+from torch import Tensor
+from pathlib import Path
+from typing import Dict, List, Tuple
+from .utils import LSTM_Direction, get_checkpoint_path
+from .model import REModel
+from .h_d_lstm import CustomLSTM, recurrence
+
+EXPORTED_MODEL_FILE = "model.pt"
+EXPORT_SOURCE_FILE = "source.txt" # Content hash and file stat of the checkpoint exported
+
+
+class ExportedLSTMLayer(torch.nn.Module):
+    """
+    TorchScript compatible equivalent of `CustomLSTM.forward_padded`, sharing the weights of `layer`
+    """
+
+    def __init__(self, layer: CustomLSTM):
+        super().__init__()
+        self.input_linearity = layer.input_linearity
+        self.state_linearity = layer.state_linearity
+        self.hidden_size: int = layer.hidden_size
+        self.highway: bool = layer.highway
+        self.forward_direction: bool = layer.direction == LSTM_Direction.forward
+
+
+    def forward(self, sequence_tensor: Tensor, batch_lengths: List[int]) -> Tensor:
+        projected_inputs = self.input_linearity(sequence_tensor)
+        output, _, _ = recurrence(projected_inputs, batch_lengths,
+                                  self.state_linearity.weight, self.state_linearity.bias,
+                                  self.hidden_size, self.highway, self.forward_direction)
+        return output
+
+
+class ExportedREModel(torch.nn.Module):
+    """
+    TorchScript compatible equivalent of `REModel.forward` for prediction, sharing the weights of `model`
+      -- Takes input tensors and lengths directly instead of a dictionary
+      -- Returns (logits, class probabilities) for decoding with `Decoder`
+    """
+
+    def __init__(self, model: REModel):
+        super().__init__()
+        self.token_embedding = model.token_embedding
+        self.ne_embedding = model.ne_embedding
+        self.pos_embedding = model.pos_embedding
+        self.lstm_layers = torch.nn.ModuleList([ExportedLSTMLayer(layer) for layer in model.lstm_layers])
+        self.tag_layer = model.tag_layer
+
+
+    def forward(self, sent_vec: Tensor, ent_vec: Tensor, pos_vec: Tensor, lengths: List[int]) -> Tuple[Tensor, Tensor]:
+        output = torch.cat([self.token_embedding(sent_vec), self.ne_embedding(ent_vec), self.pos_embedding(pos_vec)], dim=-1)
+
+        # As with `REModel.forward`, sorted by decreasing length unless already sorted
+        is_sorted = True
+        for i in range(1, len(lengths)):
+            if lengths[i] > lengths[i - 1]:
+                is_sorted = False
+        sorted_lengths = lengths
+        restoration_order = torch.arange(len(lengths))
+        if not is_sorted:
+            lengths_tensor, sorted_order = torch.sort(torch.tensor(lengths), descending=True)
+            sorted_lengths = torch.jit.annotate(List[int], lengths_tensor.tolist())
+            restoration_order = torch.argsort(sorted_order)
+            output = output.index_select(0, sorted_order.to(output.device))
+
+        for layer in self.lstm_layers:
+            output = layer(output, sorted_lengths)
+
+        if not is_sorted:
+            output = output.index_select(0, restoration_order.to(output.device))
+        logits = self.tag_layer(output)
+        return logits, torch.nn.functional.softmax(logits, dim=-1)
+
+
+def export_model(model: REModel, model_config: Dict, export_dir: str, checkpoint_path: str = None):
+    """
+    Writes self-contained prediction artifact of trained model to `export_dir`, loaded by `serving.Predictor`
+      -- model.pt: TorchScript model including embeddings and tag layer (CPU)
+      -- tokens.txt, pos.txt, labels.txt: Vocabularies of model
+      -- source.txt: Hash, modification time and size of `checkpoint_path` if given, see `is_export_current`
+    Arguments:
+        model: Trained (float32) model, left unchanged
+        model_config: Configuration of model, for vocabulary directories
+        export_dir: Directory to write artifact to
+        checkpoint_path: Checkpoint file model was loaded from
+    """
+    export_dir = Path(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    cpu_model = copy.deepcopy(model).cpu()
+    scripted_model = torch.jit.script(ExportedREModel(cpu_model))
+    torch.jit.save(scripted_model, str(Path.joinpath(export_dir, EXPORTED_MODEL_FILE)))
+    for vocab_dir, vocab_file in [(model_config["tokens_dir"], "tokens.txt"), (model_config["pos_dir"], "pos.txt"),
+                                  (model_config["labels_dir"], "labels.txt")]:
+        shutil.copyfile(str(Path.joinpath(Path(vocab_dir), vocab_file)), str(Path.joinpath(export_dir, vocab_file)))
+    if checkpoint_path:
+        checkpoint_stat = Path(checkpoint_path).stat()
+        with open(str(Path.joinpath(export_dir, EXPORT_SOURCE_FILE)), "w") as source_file:
+            source_file.write("{}\n{} {}\n".format(_file_hash(checkpoint_path), checkpoint_stat.st_mtime_ns,
+                                                     checkpoint_stat.st_size))
+
+
+def is_export_current(export_dir: str, predict_path: str) -> bool:
+    """
+    Whether the model exported to `export_dir` is to be served for the trained model at `predict_path`
+      -- False if no export, or if checkpoint of `predict_path` differs from the one exported (By content hash,
+         read only if modification time or size differ)
+      -- True if the checkpoint is not present (Export is self-contained, e.g. deployed without checkpoints)
+    """
+    export_dir = Path(export_dir)
+    if not Path.joinpath(export_dir, EXPORTED_MODEL_FILE).exists():
+        return False
+    try:
+        checkpoint_path = get_checkpoint_path(predict_path)
+        checkpoint_stat = checkpoint_path.stat()
+    except Exception: # No checkpoint (Missing file, or save folder without saved model)
+        return True
+    source_path = Path.joinpath(export_dir, EXPORT_SOURCE_FILE)
+    if not source_path.exists(): # Export of unknown checkpoint
+        return False
+    with open(str(source_path)) as source_file:
+        source_hash, *source_stat = source_file.read().split()
+    if source_stat == [str(checkpoint_stat.st_mtime_ns), str(checkpoint_stat.st_size)]:
+        return True
+    return _file_hash(checkpoint_path) == source_hash
+
+
+def _file_hash(file_path: str) -> str:
+    with open(str(file_path), "rb") as checkpoint_file:
+        return hashlib.md5(checkpoint_file.read()).hexdigest()
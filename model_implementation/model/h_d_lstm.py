@@ -1,3 +1,4 @@
+import threading
 import torch
 import torch.nn as nn
 import numpy as np
@@ -5,7 +6,80 @@ import numpy as np
 from torch import Tensor
 from torch.nn.utils.rnn import pad_packed_sequence, pack_padded_sequence, PackedSequence
 from .utils import *
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
+
+_script_lock = threading.Lock()
+_scripted_recurrence = None # `recurrence` compiled, see `get_scripted_recurrence`
+
+
+def recurrence(projected_inputs: Tensor, batch_lengths: List[int],
+               state_weight: Tensor, state_bias: Tensor,
+               hidden_size: int, highway: bool, forward: bool):
+    """
+    TorchScript compatible equivalent of `CustomLSTM._recurrence` (Refer to it for documentation), compiled
+    with `get_scripted_recurrence` or as part of a scripted module (`export.ExportedLSTMLayer`)
+    Returns:
+        (Output of all time-steps, final memory, final state)
+    """
+    batch_size = projected_inputs.size(0)
+    total_timesteps = projected_inputs.size(1)
+    output_accumulator = projected_inputs.new_zeros([batch_size, total_timesteps, hidden_size])
+    timestep_end_index = batch_size - 1 if forward else 0
+    complete_batch_previous_memory = projected_inputs.new_zeros([batch_size, hidden_size])
+    complete_batch_previous_state = projected_inputs.new_zeros([batch_size, hidden_size])
+
+    for step in range(total_timesteps):
+        timestep = step if forward else total_timesteps - 1 - step
+        if forward:
+            while batch_lengths[timestep_end_index] <= timestep:
+                timestep_end_index -= 1
+        else:
+            while timestep_end_index < batch_size - 1 and batch_lengths[timestep_end_index + 1] > timestep:
+                timestep_end_index += 1
+        num_active = timestep_end_index + 1
+
+        # Slices are only read, new hidden states are concatenated instead of written in place
+        previous_memory = complete_batch_previous_memory[0: num_active]
+        previous_state = complete_batch_previous_state[0: num_active]
+        projected_input = projected_inputs[0: num_active, timestep]
+        projected_state = torch.nn.functional.linear(previous_state, state_weight, state_bias)
+
+        input_gate = torch.sigmoid(projected_input[:, 0 * hidden_size:1 * hidden_size] +
+                                   projected_state[:, 0 * hidden_size:1 * hidden_size])
+        forget_gate = torch.sigmoid(projected_input[:, 1 * hidden_size:2 * hidden_size] +
+                                    projected_state[:, 1 * hidden_size:2 * hidden_size])
+        memory_init = torch.tanh(projected_input[:, 2 * hidden_size:3 * hidden_size] +
+                                 projected_state[:, 2 * hidden_size:3 * hidden_size])
+        output_gate = torch.sigmoid(projected_input[:, 3 * hidden_size:4 * hidden_size] +
+                                    projected_state[:, 3 * hidden_size:4 * hidden_size])
+        memory = input_gate * memory_init + forget_gate * previous_memory
+        timestep_output = output_gate * torch.tanh(memory)
+
+        if highway:
+            highway_gate = torch.sigmoid(projected_input[:, 4 * hidden_size:5 * hidden_size] +
+                                         projected_state[:, 4 * hidden_size:5 * hidden_size])
+            highway_input_projection = projected_input[:, 5 * hidden_size:6 * hidden_size]
+            timestep_output = highway_gate * timestep_output + (1 - highway_gate) * highway_input_projection
+
+        complete_batch_previous_memory = torch.cat([memory, complete_batch_previous_memory[num_active:]], 0)
+        complete_batch_previous_state = torch.cat([timestep_output, complete_batch_previous_state[num_active:]], 0)
+        output_accumulator[0: num_active, timestep] = timestep_output
+
+    return output_accumulator, complete_batch_previous_memory, complete_batch_previous_state
+
+
+def get_scripted_recurrence():
+    """
+    `recurrence` compiled with TorchScript, avoiding python dispatch per time-step, selected with `jit_lstm`
+    in model configuration
+      - Compiled once per process on first use, not on import
+    """
+    global _scripted_recurrence
+    with _script_lock:
+        if _scripted_recurrence is None:
+            _scripted_recurrence = torch.jit.script(recurrence)
+        return _scripted_recurrence
+
 
 class CustomLSTM(torch.nn.Module):
 
@@ -16,6 +90,7 @@ class CustomLSTM(torch.nn.Module):
         self.highway = config["highway"]
         self.dropout = config["dropout"] # Ignore this for now
         self.direction = config["direction"]
+        self.jit = config.get("jit_lstm", False) # Use TorchScript compiled time-step loop
 
         # Optimize with singular matrix computation
         # In the case of Highway networks, 2 additional input gates and 1 additional state gate are required
@@ -41,12 +116,53 @@ class CustomLSTM(torch.nn.Module):
     def forward(self, inputs: PackedSequence, initial_state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None):
 
         sequence_tensor, batch_lengths = pad_packed_sequence(inputs, batch_first=True)
+        output_accumulator, final_state = self.forward_padded(sequence_tensor, batch_lengths.tolist())
+        output_accumulator = pack_padded_sequence(output_accumulator, batch_lengths, batch_first=True)
+        return output_accumulator, final_state
+
+
+    def forward_padded(self, sequence_tensor: Tensor, batch_lengths: List[int]):
+        """
+        Padded tensor equivalent of `forward`, allows for stacking of layers without packing in between
+        Arguments:
+            sequence_tensor: Padded sequences (batch, time, input) sorted by decreasing length
+            batch_lengths: Lengths of sequences (decreasing order)
+        Returns:
+            Padded output (batch, time, hidden) with zeros beyond each sequence length, final state
+        """
+        # The input projection does not depend on the recurrent state, project all time-steps at once
+        # (batch, time, input) --> (batch, time, 6 * hidden) with highway, (batch, time, 4 * hidden) otherwise
+        projected_inputs = self.input_linearity(sequence_tensor)
+
+        if self.jit:
+            output_accumulator, final_memory, final_state = get_scripted_recurrence()(
+                projected_inputs, batch_lengths,
+                self.state_linearity.weight, self.state_linearity.bias,
+                self.hidden_size, self.highway, self.direction == LSTM_Direction.forward)
+        else:
+            output_accumulator, final_memory, final_state = self._recurrence(projected_inputs, batch_lengths)
+
+        # Mimic the pytorch API by returning state in the following shape:
+        # (num_layers * num_directions, batch_size, hidden_size). As this
+        # LSTM cannot be stacked, the first dimension here is just 1.
+        final_state = (final_state.unsqueeze(0), final_memory.unsqueeze(0))
 
-        batch_size = sequence_tensor.size()[0]
-        total_timesteps = sequence_tensor.size()[1]
+        return output_accumulator, final_state
+
+
+    def _recurrence(self, projected_inputs: Tensor, batch_lengths: List[int]):
+        """
+        Runs LSTM over time-steps of padded sequences sorted by decreasing length
+        Arguments:
+            projected_inputs: Output of `input_linearity` for all time-steps (batch, time, gates * hidden)
+        Returns:
+            (Output of all time-steps, final memory, final state)
+        """
+        batch_size = projected_inputs.size()[0]
+        total_timesteps = projected_inputs.size()[1]
 
         # For the accumulation time-step outputs to pass to the next layer
-        output_accumulator = sequence_tensor.new_zeros(batch_size, total_timesteps, self.hidden_size)
+        output_accumulator = projected_inputs.new_zeros(batch_size, total_timesteps, self.hidden_size)
 
         # Considering variable length inputs, we can omit calculations for when, at the current
         # time-step, the sequence at `timestep_end_index` has already exhausted all time-steps
@@ -60,8 +176,8 @@ class CustomLSTM(torch.nn.Module):
         # The naming of our hidden states is to accommodate the above optimization, since not all
         # hidden states in the batch are required at every time-step
         # We assume no input initial states (Zero initialization)
-        complete_batch_previous_memory = sequence_tensor.new_zeros(batch_size, self.hidden_size)
-        complete_batch_previous_state = sequence_tensor.new_zeros(batch_size, self.hidden_size)
+        complete_batch_previous_memory = projected_inputs.new_zeros(batch_size, self.hidden_size)
+        complete_batch_previous_state = projected_inputs.new_zeros(batch_size, self.hidden_size)
 
         timesteps = range(total_timesteps) if self.direction == LSTM_Direction.forward else \
             reversed(range(total_timesteps)) # Reverse timestep indexing for backward direction
@@ -84,10 +200,8 @@ class CustomLSTM(torch.nn.Module):
             previous_memory = complete_batch_previous_memory[0: timestep_end_index + 1].clone()
             previous_state = complete_batch_previous_state[0: timestep_end_index + 1].clone()
 
-            # Calculations
-            timestep_input = sequence_tensor[0: timestep_end_index + 1, timestep]
-
-            projected_input = self.input_linearity(timestep_input)
+            # Calculations, only the state projection is sequential
+            projected_input = projected_inputs[0: timestep_end_index + 1, timestep]
             projected_state = self.state_linearity(previous_state)
 
             # Main LSTM equations using relevant chunks of the big linear
@@ -117,15 +231,7 @@ class CustomLSTM(torch.nn.Module):
             complete_batch_previous_state[0:timestep_end_index + 1] = timestep_output
             output_accumulator[0:timestep_end_index + 1, timestep] = timestep_output
 
-        output_accumulator = pack_padded_sequence(output_accumulator, batch_lengths, batch_first=True)
-
-        # Mimic the pytorch API by returning state in the following shape:
-        # (num_layers * num_directions, batch_size, hidden_size). As this
-        # LSTM cannot be stacked, the first dimension here is just 1.
-        final_state = (complete_batch_previous_state.unsqueeze(0),
-                       complete_batch_previous_memory.unsqueeze(0))
-
-        return output_accumulator, final_state
+        return output_accumulator, complete_batch_previous_memory, complete_batch_previous_state
 
 
 
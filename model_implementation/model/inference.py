@@ -0,0 +1,70 @@
+import copy
+import torch
+from torch import Tensor
+from .model import REModel
+try: # Quantization under torch.ao (torch >= 1.10), torch.nn.quantized / torch.quantization are deprecated
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+    from torch.ao.quantization import default_dynamic_qconfig
+except ImportError:
+    from torch.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+    from torch.quantization import default_dynamic_qconfig
+
+INFERENCE_PRECISIONS = ["fp32", "int8", "bf16"]
+
+
+class BFloat16Linear(torch.nn.Module):
+    """
+    Linear layer with bfloat16 weights, inputs are cast to bfloat16 for the matrix multiplication and
+    outputs cast back to float32, hence the LSTM recurrence and decoding remain in float32
+    """
+
+    def __init__(self, linear: torch.nn.Linear):
+        super().__init__()
+        self.weight = torch.nn.Parameter(linear.weight.detach().to(torch.bfloat16), requires_grad=False)
+        self.bias = torch.nn.Parameter(linear.bias.detach().to(torch.bfloat16), requires_grad=False) \
+            if linear.bias is not None else None
+
+
+    def forward(self, inputs: Tensor):
+        return torch.nn.functional.linear(inputs.to(torch.bfloat16), self.weight, self.bias).float()
+
+
+def _convert_linear(linear: torch.nn.Linear, precision: str):
+    if precision == "bf16":
+        return BFloat16Linear(linear)
+    # Dynamic quantization: int8 weights, activations quantized per call according to their range
+    linear.qconfig = default_dynamic_qconfig
+    return DynamicQuantizedLinear.from_float(linear)
+
+
+def get_inference_model(model: REModel, precision: str = "fp32") -> REModel:
+    """
+    Prediction only copy of trained model, with `input_linearity` and `state_linearity` of every LSTM layer
+    and `tag_layer` in reduced precision
+      -- fp32: No conversion
+      -- int8: Dynamic int8 quantization of weights and activations
+      -- bf16: bfloat16 weights and matrix multiplications
+    Arguments:
+        model: Trained (float32) model, left unchanged
+        precision: One of `INFERENCE_PRECISIONS`
+    Returns:
+        `model` itself for fp32, converted copy otherwise
+    """
+    if precision not in INFERENCE_PRECISIONS:
+        raise Exception("Unknown inference precision {}, expected one of {}".format(precision, INFERENCE_PRECISIONS))
+    if precision == "fp32":
+        return model
+
+    # Layers are converted individually, `REModel.train` being an attribute rules out `quantize_dynamic`
+    # on the whole model (which sets the model to evaluation mode)
+    # Frozen (memory-mapped) token embeddings are shared with `model` rather than copied, if already on CPU
+    shared_modules = { id(model.token_embedding): model.token_embedding } \
+        if model.token_embedding.weight.device.type == "cpu" else {}
+    inference_model = copy.deepcopy(model, shared_modules).cpu() # Quantized and bfloat16 layers target CPU
+    inference_model.train = False
+    for layer in inference_model.lstm_layers:
+        layer.input_linearity = _convert_linear(layer.input_linearity, precision)
+        layer.state_linearity = _convert_linear(layer.state_linearity, precision)
+        layer.jit = False # Scripted recurrence takes float32 state weights directly
+    inference_model.tag_layer = _convert_linear(inference_model.tag_layer, precision)
+    return inference_model
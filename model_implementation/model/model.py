@@ -1,10 +1,14 @@
+import os
+import numpy as np
 import torch
 from torch import Tensor
-from torch.nn.utils.rnn import PackedSequence, pack_padded_sequence, pad_packed_sequence
 from pathlib import Path
 from .utils import *
 from .h_d_lstm import CustomLSTM
 
+TOKEN_EMBEDDER_MMAP = "token_embedder.npy" # float32 token embedding weights, memory-mapped
+TOKEN_EMBEDDER_STAT = "token_embedder.stat.npy" # Modification time and size of token_embedder converted
+
 
 class REModel(torch.nn.Module):
 
@@ -19,7 +23,7 @@ class REModel(torch.nn.Module):
 
     def __init__(self, config):
         super().__init__()
-        self.config = config
+        self.config = dict(config) # Layer instantiation alters input_size and direction, retain caller's config
         self._load_embeddings()
         self.bdlstm = self._instantiate_bdlstm()
         self._load_tag_layer()
@@ -32,7 +36,7 @@ class REModel(torch.nn.Module):
         """
         # Load weights for token embedding layer (The embedding is mandatory)
         token_embedding_dir = self.config["tokens_dir"]
-        token_emb_weights = torch.load(Path.joinpath(token_embedding_dir, "token_embedder"))
+        token_emb_weights = self._load_token_embedding_weights(token_embedding_dir)
         self.token_embedding = torch.nn.Embedding(self.config["num_tokens"], self.config["token_embedding_dim"],
                                                   Constants.PAD_INDEX, _weight=token_emb_weights)
         self.token_embedding.weight.requires_grad = False # Don't train token embeddings
@@ -58,6 +62,50 @@ class REModel(torch.nn.Module):
                 self.pos_embedding.weight = pos_emb_weights
 
 
+    def _load_token_embedding_weights(self, token_embedding_dir: str) -> Tensor:
+        """
+        Token embedding weights memory-mapped from `token_embedder.npy`, shared between processes through the page cache
+          - Converted from `token_embedder` if not present or if `token_embedder` changed since (By modification
+            time and size, saved to `token_embedder.stat.npy`), loaded directly if tokens_dir is not writable
+          - Mapped copy-on-write, the frozen weights are never written to hence never copied
+        """
+        source_path = Path.joinpath(token_embedding_dir, "token_embedder")
+        mmap_path = Path.joinpath(token_embedding_dir, TOKEN_EMBEDDER_MMAP)
+        stat_path = Path.joinpath(token_embedding_dir, TOKEN_EMBEDDER_STAT)
+        source_stat = source_path.stat() if source_path.exists() else None # Converted weights only, if deployed so
+        source_stat = np.array([source_stat.st_mtime_ns, source_stat.st_size], dtype=np.int64) if source_stat else None
+        if mmap_path.exists() and (source_stat is None or
+                                   (stat_path.exists() and np.array_equal(np.load(str(stat_path)), source_stat))):
+            return torch.from_numpy(np.load(str(mmap_path), mmap_mode="c"))
+
+        token_emb_weights = torch.load(source_path)
+        try: # Written to temporary files first, such that concurrent loads never read a partial file
+            for path, array in [(mmap_path, token_emb_weights.detach().numpy().astype(np.float32)),
+                                (stat_path, source_stat)]: # Stat last, validates the weights
+                partial_path = Path.joinpath(token_embedding_dir, "{}.{}.partial".format(path.name, os.getpid()))
+                with open(str(partial_path), "wb") as f:
+                    np.save(f, array)
+                os.replace(str(partial_path), str(path))
+        except OSError:
+            return token_emb_weights
+        return torch.from_numpy(np.load(str(mmap_path), mmap_mode="c"))
+
+
+    def load_state_dict(self, state_dict: Dict, strict: bool = True):
+        """
+        Frozen token embedding weights are kept as loaded from tokens_dir rather than copied from `state_dict`,
+        such that memory-mapped weights remain shared
+        """
+        frozen_keys = {"token_embedding.weight"}
+        state_dict = { key: value for key, value in state_dict.items() if key not in frozen_keys }
+        model_keys = set(self.state_dict().keys()) - frozen_keys
+        missing_keys, unexpected_keys = model_keys - set(state_dict.keys()), set(state_dict.keys()) - model_keys
+        if strict and (missing_keys or unexpected_keys):
+            raise Exception("Error loading state dict, missing keys: {} | unexpected keys: {}".format(
+                sorted(missing_keys), sorted(unexpected_keys)))
+        return super().load_state_dict(state_dict, strict=False)
+
+
     def _instantiate_bdlstm(self):
         # Load weights for bi-directional LSTM
         input_size = self.config["input_size"]
@@ -101,34 +149,33 @@ class REModel(torch.nn.Module):
                 self.tag_layer.bias = tag_layer_bias
 
 
-    def _sort_and_pack_embeddings(self, full_embeddings: Tensor, lengths: List):
+    def _is_sorted(self, lengths: List):
+        # Whether lengths are in decreasing order (Longest --> Shortest)
+        return all(prev_length >= length for prev_length, length in zip(lengths, lengths[1:]))
+
+
+    def _sort_embeddings(self, full_embeddings: Tensor, lengths: List):
         """
         Sorts instances of sentences, predicates based on length (Longest --> Shortest)
         Returns:
-            Packed sequence (batch first)
+            Sorted padded embeddings (batch first)
+            Sorted lengths
             Indices to restore the original order of the sequences
         """
 
         assert(len(full_embeddings) == len(lengths))
 
-        # Zip list of numbering indices for restoration purposes
-        zipped_embeddings_lengths = zip(full_embeddings, lengths, range(len(lengths)))
-        sorted_embeddings_lengths = sorted(zipped_embeddings_lengths, key=lambda x: x[1], reverse=True)
-        sorted_embeddings, sorted_lengths, original_order = [list(t) for t in zip(*sorted_embeddings_lengths)]
-        sorted_embeddings = torch.stack(sorted_embeddings)
-        return pack_padded_sequence(sorted_embeddings, sorted_lengths, batch_first=True), original_order
+        sorted_lengths, sorted_order = torch.sort(torch.tensor(lengths), descending=True)
+        restoration_order = torch.argsort(sorted_order) # Inverse permutation of sorted_order
+        sorted_embeddings = full_embeddings.index_select(0, sorted_order.to(full_embeddings.device))
+        return sorted_embeddings, sorted_lengths.tolist(), restoration_order.to(full_embeddings.device)
 
 
-    def _unpack_and_reorder(self, packed_output: PackedSequence, original_order: List[int]):
+    def _restore_order(self, sorted_output: Tensor, restoration_order: Tensor):
         """
-        Unpacks packed sequence and reorders according to original index
+        Reorders padded output according to original index
         """
-        unpacked = pad_packed_sequence(packed_output, batch_first=True)
-        unpacked_tensors = unpacked[0]
-        zipped_tensors = zip(unpacked_tensors, original_order)
-        sorted_zipped_tensors = sorted(zipped_tensors, key=lambda x: x[1])
-        sorted_tensors, _ = [list(t) for t in zip(*sorted_zipped_tensors)]
-        return torch.stack(sorted_tensors)
+        return sorted_output.index_select(0, restoration_order)
 
 
     def _get_output_dict(self, output_tensors: Tensor, mask: Tensor):
@@ -160,16 +207,19 @@ class REModel(torch.nn.Module):
         embedded_pos = self.pos_embedding(pos_vec)
         full_embeddings = torch.cat([embedded_sentences, embedded_ents, embedded_pos], dim=-1)
 
-        # Sort and pack padded sequence (pytorch default api requires that sequences be sorted)
-        packed, original_order = self._sort_and_pack_embeddings(full_embeddings, input_dict["lengths"])
+        # Sort once, sequences stay padded and sorted by decreasing length throughout the LSTM stack
+        # Batches already sorted by the caller (Bucketed batches, prediction) skip sorting and restoration
+        lengths = input_dict["lengths"]
+        if self._is_sorted(lengths):
+            output_tensors, sorted_lengths, restoration_order = full_embeddings, list(lengths), None
+        else:
+            output_tensors, sorted_lengths, restoration_order = self._sort_embeddings(full_embeddings, lengths)
 
-        hidden_states = [None] * len(self.lstm_layers)
-        output_sequence: PackedSequence = packed
-        for i, state in enumerate(hidden_states):
-            layer = self.lstm_layers[i]
-            output_sequence, _ = layer(output_sequence, state) # Ignore final state of lstm layer
+        for layer in self.lstm_layers:
+            output_tensors, _ = layer.forward_padded(output_tensors, sorted_lengths) # Ignore final state of lstm layer
 
-        output_tensors = self._unpack_and_reorder(output_sequence, original_order)
+        if restoration_order is not None:
+            output_tensors = self._restore_order(output_tensors, restoration_order)
         output_dict = self._get_output_dict(output_tensors, input_dict["mask"]) # Class probabilities to be decoded
 
         if self.train:
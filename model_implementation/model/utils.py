@@ -1,10 +1,12 @@
 import logging
+import os
+import re
 import numpy as np
-import spacy
 from torch import Tensor
 from pathlib import Path
 from typing import Dict, List
 from enum import Enum
+from ..spacy_pipelines import get_pipeline
 
 
 class Constants:
@@ -49,13 +51,20 @@ class POS:
         return self.pos_to_idx[pos]
 
 
+COMPILED_VOCABULARY = "tokens.compiled" # Prefix of memory-mapped arrays of tokens.txt, see `Vocabulary.load_from_dir`
+
+
 class Vocabulary:
     """
     Bidirectional mapping of words of indexes
+      - Loaded from compiled vocabulary as memory-mapped arrays, dictionary and list of words are
+        only built if accessed (`word_to_idx`, `idx_to_word`), lookups otherwise use the arrays directly
     """
     def __init__(self, vocab_dir: str, words=[]):
-        self.word_to_idx, self.idx_to_word = self._instantiate(words)
-        self.vocab_len = len(self.idx_to_word)
+        self._word_to_idx, self._idx_to_word = self._instantiate(words)
+        self._words = None # Words by index as fixed width UTF-8 bytes (Memory-mapped)
+        self._sorter = None # Indexes of words in sorted order of words, for binary search
+        self.vocab_len = len(self._idx_to_word)
         self.load_from_dir(vocab_dir)
 
 
@@ -76,12 +85,32 @@ class Vocabulary:
         return word_idx_map, idx_word_map
 
 
+    @property
+    def idx_to_word(self) -> List:
+        self._materialize()
+        return self._idx_to_word
+
+
+    @property
+    def word_to_idx(self) -> Dict:
+        self._materialize()
+        return self._word_to_idx
+
+
+    def _materialize(self):
+        # Builds list and dictionary from compiled arrays, which are no longer used thereafter
+        if self._words is not None:
+            self._idx_to_word = [word.decode("utf-8") for word in self._words]
+            self._word_to_idx = { word: index for index, word in enumerate(self._idx_to_word) }
+            self._words, self._sorter = None, None
+
+
     def add_word(self, word: str):
         if word in self.word_to_idx:
             logging.log(logging.WARN, "Word: [%s] already in vocab" % word)
         else:
-            self.idx_to_word.append(word)
-            self.word_to_idx[word] = self.vocab_len
+            self._idx_to_word.append(word)
+            self._word_to_idx[word] = self.vocab_len
             self.vocab_len = self.vocab_len + 1
 
 
@@ -89,24 +118,66 @@ class Vocabulary:
         """
         Reads tokens from tokens file with 1 token for each line
         Considering GLOVE embedding tokens and vectors are contained in one file, we preprocess it first
+          - Words are saved to `tokens.compiled.*.npy` and memory-mapped directly while tokens.txt is unchanged
+            (Only if no initial words are given)
         """
-        tokens = "tokens.txt"
-        with open(Path.joinpath(vocab_dir, tokens)) as v:
+        tokens_path = Path.joinpath(vocab_dir, "tokens.txt")
+        tokens_stat = tokens_path.stat()
+        tokens_stat = np.array([tokens_stat.st_mtime_ns, tokens_stat.st_size], dtype=np.int64)
+        compiled_paths = { part: Path.joinpath(vocab_dir, "{}.{}.npy".format(COMPILED_VOCABULARY, part))
+                           for part in ("words", "sorter", "stat") }
+        use_compiled = self.vocab_len == 2 # Padding and Unknown only
+        if use_compiled and all(path.exists() for path in compiled_paths.values()):
+            words = np.load(str(compiled_paths["words"]), mmap_mode="r")
+            sorter = np.load(str(compiled_paths["sorter"]), mmap_mode="r")
+            if np.array_equal(np.load(str(compiled_paths["stat"])), tokens_stat) and len(words) == len(sorter):
+                self._words, self._sorter = words, sorter
+                self.vocab_len = len(words)
+                return
+
+        with open(tokens_path) as v:
             for line in v:
                 if "@@UNKNOWN" in line: # Ignore UNK tag from Allen, already present in Constants
                     continue
                 self.add_word(line.split("\n")[0])
 
+        if use_compiled:
+            words = np.array([word.encode("utf-8") for word in self._idx_to_word])
+            compiled = { "words": words, "sorter": np.argsort(words, kind="stable"), "stat": tokens_stat }
+            try: # Written to temporary files first, such that concurrent loads never read a partial file
+                for part in ("words", "sorter", "stat"): # Stat last, validates the others
+                    partial_path = Path.joinpath(vocab_dir, "{}.{}.{}.partial.npy".format(
+                        COMPILED_VOCABULARY, part, os.getpid()))
+                    np.save(str(partial_path), compiled[part])
+                    os.replace(str(partial_path), str(compiled_paths[part]))
+            except OSError: # Directory not writable, tokens.txt is read on every load
+                pass
+
 
     def get_word_from_index(self, index: int):
         assert(index < self.vocab_len)
-        return self.idx_to_word[index]
+        return self._words[index].decode("utf-8") if self._words is not None else self._idx_to_word[index]
 
 
     def get_index_from_word(self, word: str):
-        assert(isinstance(word, str))
-        return self.word_to_idx[word] if word in self.word_to_idx else \
-            self.word_to_idx[Constants.UNKNOWN]
+        return int(self.encode([word])[0])
+
+
+    def encode(self, words: List[str]) -> np.ndarray:
+        # Indexes of words (Unknown for words not in vocabulary) in a single call, words are to be strings
+        # (e.g. not NaN of empty / "NA" tokens read by pandas)
+        assert(all(isinstance(word, str) for word in words))
+        if self._words is None:
+            word_to_idx = self._word_to_idx
+            return np.fromiter((word_to_idx.get(word, Constants.UNK_INDEX) for word in words), dtype=np.int64,
+                               count=len(words))
+        if len(words) == 0:
+            return np.zeros(0, dtype=np.int64)
+        # Binary search over sorted words, compared at width of the longer of query and vocabulary words
+        queries = np.array([word.encode("utf-8") for word in words])
+        positions = np.minimum(np.searchsorted(self._words, queries, sorter=self._sorter), len(self._sorter) - 1)
+        indexes = np.asarray(self._sorter[positions], dtype=np.int64)
+        return np.where(self._words[indexes] == queries, indexes, Constants.UNK_INDEX)
 
 
 class Labels:
@@ -146,24 +217,41 @@ class Labels:
 class Preprocessor:
 
     def __init__(self, vocab: Vocabulary, labels: Labels, pos: POS):
-        self.spacy_nlp = spacy.load("en_core_web_sm")
+        self._spacy_nlp = None # Shared pipeline, loaded on first use, not required for training
         self.vocab = vocab
         self.labels = labels
         self.pos = pos
 
 
-    def vectorize_sentence(self, sentence: str) -> List[Dict]:
+    @property
+    def spacy_nlp(self):
+        if self._spacy_nlp is None:
+            self._spacy_nlp = get_pipeline("tagger", "parser", "ner") # POS, noun chunks and named entities
+        return self._spacy_nlp
+
+
+    def __getstate__(self):
+        # Spacy pipeline is not sent to other processes (e.g. data loading workers), reloaded on use
+        state = self.__dict__.copy()
+        state["_spacy_nlp"] = None
+        return state
+
+
+    def vectorize_sentence(self, sentence: str, tokens=None) -> List[Dict]:
         """
         Purely for prediction purposes, tokenizes and generates vectors for entity and part-of-speech
+        Arguments:
+            sentence: Raw sentence
+            tokens: Optional spacy Doc of sentence if already tokenized (e.g. by `tokenize_batch`)
         Returns:
             Dictionary of sent_vec (token indexes), ent_vec (1 for ENT1, 2 for ENT2, 0 otherwise),
             pos_vec (index of POS tag of each token)
         """
-        paired = self._pair_sentence_ent(sentence)
+        paired = self._pair_sentence_ent(sentence, tokens)
         vectorized_instances: List[Dict] = []
         for sent_pred_pair in paired:
             tokens, ents_index = sent_pred_pair["tokens"], sent_pred_pair["ents_index"]
-            sent_vec = [self.vocab.get_index_from_word(token.text) for token in tokens] # Tokens are spacy tokens
+            sent_vec = self.vocab.encode([token.text for token in tokens]) # Tokens are spacy tokens
             ent_vec = [1 if i in ents_index[0] else 2 if i in ents_index[1] else 0 for i in range(len(tokens))]
             pos_vec = [self.pos.get_index_from_pos(token.pos_) for token in tokens]
             vectorized_instances.append({ "sent_vec": np.asarray(sent_vec),
@@ -183,7 +271,7 @@ class Preprocessor:
             pos_vec (index of POS tag of each token) and tags_vec (tag indexes)
         """
         assert(len(tokens) == len(tags))
-        sent_vec = [self.vocab.get_index_from_word(token) for token in tokens] # Tokens are strings
+        sent_vec = self.vocab.encode(tokens) # Tokens are strings
         ent_vec = [1 if "ENT1" in label else 2 if "ENT2" in label else 0 for label in tags]
         pos_vec = [self.pos.get_index_from_pos(word_pos) for word_pos in pos]
         tags_vec = [self.labels.get_index_from_word(tag) for tag in tags]
@@ -194,6 +282,31 @@ class Preprocessor:
                    })]
 
 
+    def vectorize_batch(self, tokens_list: List[List], tags_list: List[List], pos_list: List[List]) -> Dict:
+        """
+        Vectorizes and pads tokens and tags for training
+        Arguments:
+            tokens_list: List of (List of string words)
+            tags_list: List of (List of string tags)
+            pos_list: List of (List of string word POS)
+        Returns:
+            Dictionary of sentence vector (token indexes), entity vector,
+            sequence_lengths and sequence mask and tags vector (tag indexes)
+        """
+        assert(len(tokens_list) == len(tags_list))
+        vectorized_list: List[Dict] = []
+        for tokens, tags, pos in zip(tokens_list, tags_list, pos_list):
+            vectorized_list += self.vectorize_token_tags(tokens, tags, pos)
+        sents_vec, ents_vec, pos_vec, lens_vec, mask, tags_vec = self.pad_batch(vectorized_list)
+        return { "sent_vec": sents_vec.long(),
+                 "ent_vec": ents_vec.long(),
+                 "pos_vec": pos_vec.long(),
+                 "lengths": lens_vec,
+                 "mask": mask.long(),
+                 "tags_vec": tags_vec.long()
+                 }
+
+
     def pad_batch(self, batch_instances: List[Dict]):
         """
         Pads all sentences to the maximum length of the batch to facilitate padding packed sequence
@@ -242,14 +355,19 @@ class Preprocessor:
         return self.spacy_nlp(sentence)
 
 
-    def _pair_sentence_ent(self, sentence: str) -> List[Dict]:
+    def tokenize_batch(self, sentences: List[str], batch_size: int = 256):
+        # Tokenize multiple sentences in a single spacy pipeline pass
+        return list(self.spacy_nlp.pipe(sentences, batch_size=batch_size))
+
+
+    def _pair_sentence_ent(self, sentence: str, tokens=None) -> List[Dict]:
         """
-        Tokenizes and generates index pairs of entities (external NER detection)
+        Tokenizes (unless already tokenized) and generates index pairs of entities (external NER detection)
         Returns:
             List of Dict each: { sentence as list of Spacy tokens,
                                  pair of entity indexes as Tuple of 2 lists containing their indexes }
         """
-        tokens = self.tokenize(sentence)
+        tokens = self.tokenize(sentence) if tokens is None else tokens
         ent_idx_map = self._get_entity_idx_map(tokens)
         ent_idxs = list(ent_idx_map.values())
         ent_pairs = []
@@ -296,5 +414,24 @@ class Preprocessor:
         # return ent_idx_map
 
 
+BEST_MODEL_POINTER = "best_model.txt" # Name of best model file within model save folder
 
 
+def get_checkpoint_path(predict_path: str) -> Path:
+    """
+    Checkpoint file of `predict_path`, if `predict_path` is a directory:
+      -- Best model of training as pointed to by `best_model.txt`
+      -- Latest epoch `model_epoch*` if no pointer (Saved before best models were tracked)
+    """
+    checkpoint_path = Path(predict_path)
+    if checkpoint_path.is_dir():
+        pointer_path = Path.joinpath(checkpoint_path, BEST_MODEL_POINTER)
+        if pointer_path.exists():
+            with open(str(pointer_path)) as pointer_file:
+                return Path.joinpath(checkpoint_path, pointer_file.read().strip())
+        epochs = [(int(match.group(1)), path) for path in checkpoint_path.iterdir()
+                  for match in [re.fullmatch(r"model_epoch(\d+)", path.name)] if match]
+        if not epochs:
+            raise Exception("No saved model in {} (Neither {} nor model_epoch* files)".format(checkpoint_path, BEST_MODEL_POINTER))
+        checkpoint_path = max(epochs)[1]
+    return checkpoint_path
@@ -0,0 +1,89 @@
+"""
+Prunes token vocabulary (and embeddings) to tokens observed in the training / serving corpus:
+  - Tokens are counted over generated instance files and sentences of the Sentence table in `data/store.db`
+  - Kept are the `top_k` most frequent tokens of the vocabulary occurring at least `min_count` times,
+    in their original vocabulary order
+  - Writes tokens.txt and token_embedder to output directory (token_embedder.npy is generated on first load)
+
+Set `tokens_dir` of model configuration to the output directory to use the pruned vocabulary, trained models
+remain applicable as token embeddings are frozen and loaded from `tokens_dir` (Compiled instances are recompiled)
+
+Usage: `python -m model_implementation.prune_vocabulary <output dir> [top_k] [min_count]` from root folder
+"""
+import sys
+import torch
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+from main import get_model_training_config
+from model_implementation.model.utils import Constants, Vocabulary
+from model_implementation.spacy_pipelines import get_pipeline
+from model_implementation.data_utils import parse_generated_instances
+from data.database import Database, SENTENCE_TABLE
+DEFAULT_TOP_K = 50000
+DEFAULT_MIN_COUNT = 1
+
+
+def count_tokens(instance_files: List[str], db_file: Optional[str]) -> Counter:
+    """
+    Counts of tokens in instance files and sentences of database (Tokenized as in prediction)
+    """
+    token_counts = Counter()
+    for instance_file in instance_files:
+        for tokens, _, _ in parse_generated_instances(instance_file):
+            token_counts.update(tokens)
+
+    if db_file and Path(db_file).exists():
+        tokenizer = get_pipeline() # Tokenizer only
+        database = Database(db_file)
+        sentences = (sentence for (sentence,) in database.query("SELECT sentence FROM {}".format(SENTENCE_TABLE)))
+        for doc in tokenizer.pipe(sentences):
+            token_counts.update(token.text for token in doc)
+        database.close()
+    else:
+        print("Database {} not found, counting instance files only".format(db_file))
+    return token_counts
+
+
+def prune_vocabulary(tokens_dir: str, output_dir: str, token_counts: Counter,
+                     top_k: int = DEFAULT_TOP_K, min_count: int = DEFAULT_MIN_COUNT):
+    """
+    Writes pruned vocabulary and token embeddings of `tokens_dir` to `output_dir`
+    """
+    vocab = Vocabulary(Path(tokens_dir))
+    token_emb_weights = torch.load(Path.joinpath(Path(tokens_dir), "token_embedder"))
+
+    # Padding and Unknown are implicit in vocabulary (Indexes 0 and 1), consider only words of tokens.txt
+    observed = [(index, word) for index, word in enumerate(vocab.idx_to_word)
+                if index > Constants.UNK_INDEX and token_counts[word] >= min_count]
+    observed.sort(key=lambda index_word: token_counts[index_word[1]], reverse=True)
+    kept = sorted(observed[:top_k]) # Original vocabulary order
+
+    kept_indexes = [Constants.PAD_INDEX, Constants.UNK_INDEX] + [index for index, _ in kept]
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(Path.joinpath(output_dir, "tokens.txt"), "w") as tokens_file:
+        for _, word in kept:
+            tokens_file.write(word + "\n")
+    pruned_weights = token_emb_weights[torch.tensor(kept_indexes)].clone()
+    torch.save(pruned_weights, Path.joinpath(output_dir, "token_embedder"))
+
+    num_observed = sum(1 for word in token_counts if word in vocab.word_to_idx)
+    print("Vocabulary: {} --> {} tokens ({} of {} distinct corpus tokens in vocabulary)".format(
+        vocab.vocab_len, len(kept_indexes), num_observed, len(token_counts)))
+
+
+def main(output_dir: str, top_k: int = DEFAULT_TOP_K, min_count: int = DEFAULT_MIN_COUNT):
+    impl_root = Path(__file__).parent.resolve()
+    model_config, training_config = get_model_training_config(impl_root)
+    instance_files = sorted({ str(training_config["traindata_file"]), str(training_config["testdata_file"]) })
+    db_file = Path.joinpath(impl_root.parent, "data/store.db")
+    token_counts = count_tokens([f for f in instance_files if Path(f).exists()], db_file)
+    prune_vocabulary(model_config["tokens_dir"], output_dir, token_counts, top_k, min_count)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1],
+         int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_TOP_K,
+         int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_MIN_COUNT)
@@ -0,0 +1,71 @@
+import numpy as np
+from typing import List, Optional
+
+
+class BucketBatchSampler:
+    """
+    Batches instances of similar length together to minimize padding
+      - Instances are grouped into buckets of lengths within `bucket_width` of each other
+      - Batches are formed within buckets, either of `batch_size` instances or limited to `max_tokens`
+        padded tokens (batch size * longest instance in batch)
+      - If shuffled, instances are shuffled within buckets and batches are shuffled across buckets,
+        deterministic given `seed` and epoch
+      - Instances within each batch are ordered by decreasing length, such that the model need not sort them
+    """
+
+    def __init__(self, lengths: List[int], batch_size: int, max_tokens: Optional[int] = None,
+                 bucket_width: int = 5, shuffle: bool = True, seed: int = 0):
+        """
+        Arguments:
+            lengths: Length of each instance
+            batch_size: Number of instances per batch (Ignored if max_tokens is given)
+            max_tokens: Maximum number of padded tokens per batch
+            bucket_width: Range of lengths of instances within a single bucket
+            shuffle: Shuffle within and across buckets, otherwise batches are ordered by length
+            seed: Base seed for shuffling, combined with epoch number
+        """
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.bucket_width = bucket_width
+        self.shuffle = shuffle
+        self.seed = seed
+
+
+    def get_batches(self, epoch: int = 0) -> List[List[int]]:
+        """
+        Returns:
+            List of batches, each a list of instance indexes
+        """
+        rng = np.random.RandomState(self.seed + epoch)
+        order = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        # Stable sort by bucket retains the (shuffled) order of instances within each bucket
+        buckets = self.lengths[order] // self.bucket_width
+        order = order[np.argsort(buckets, kind="stable")]
+        buckets = self.lengths[order] // self.bucket_width
+
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        batch_max_len = 0
+        for i, index in enumerate(order):
+            length = int(self.lengths[index])
+            if batch and (self._is_full(batch, max(batch_max_len, length)) or buckets[i] != buckets[i - 1]):
+                batches.append(batch)
+                batch, batch_max_len = [], 0
+            batch.append(int(index))
+            batch_max_len = max(batch_max_len, length)
+        if batch:
+            batches.append(batch)
+        # Stable sort retains the (shuffled) order of instances of equal length
+        batches = [sorted(batch, key=lambda index: self.lengths[index], reverse=True) for batch in batches]
+
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+
+    def _is_full(self, batch: List[int], max_len: int):
+        # Whether adding an instance (making the longest instance `max_len`) exceeds the batch limit
+        if self.max_tokens:
+            return (len(batch) + 1) * max_len > self.max_tokens
+        return len(batch) >= self.batch_size
@@ -0,0 +1,74 @@
+"""
+Lean prediction runtime for models exported by `export_model.py`, requiring only the TorchScript model,
+vocabularies and the Viterbi decoder (No training, optimizer or model construction)
+"""
+import torch
+from pathlib import Path
+from typing import Dict, List, Tuple
+from model_implementation.model.utils import Vocabulary, Labels, POS, Preprocessor
+from model_implementation.model.decoder import Decoder
+from model_implementation.model.export import EXPORTED_MODEL_FILE
+
+
+class Predictor:
+
+    def __init__(self, export_dir: str):
+        """
+        Arguments:
+            export_dir: Directory written by `model.export.export_model`
+        """
+        export_dir = Path(export_dir)
+        self.vocab = Vocabulary(export_dir)
+        self.labels = Labels(export_dir)
+        self.pos = POS(export_dir)
+        self.preprocessor = Preprocessor(self.vocab, self.labels, self.pos)
+        self.decoder = Decoder(self.vocab, self.labels)
+        self.model = torch.jit.load(str(Path.joinpath(export_dir, EXPORTED_MODEL_FILE)), map_location="cpu")
+
+
+    def predict(self, sentence: str, tokens=None):
+        """
+        Prediction for sentence, as with `Trainer.predict`
+        """
+        tokens = self.preprocessor.tokenize(sentence) if tokens is None else tokens # Tokenized once
+        vectorized_sentence = self.preprocessor.vectorize_sentence(sentence, tokens)
+        if len(vectorized_sentence) == 0: # No named entities found, shortcircuit
+            return []
+        output_tags = self._get_tags(vectorized_sentence)
+        return self.decoder.get_relations(tokens, output_tags, vectorized_sentence)
+
+
+    def predict_batch(self, sentences: List[str], max_instances: int = 64):
+        """
+        Prediction for multiple sentences, as with `Trainer.predict_batch`
+        Returns:
+            List of relation tuples for each sentence, in order of `sentences`
+        """
+        docs = self.preprocessor.tokenize_batch(sentences)
+        vectorized_sentences: List[List[Dict]] = []
+        instance_refs: List[Tuple] = [] # (sentence index, instance index within sentence)
+        for sent_idx, (sentence, doc) in enumerate(zip(sentences, docs)):
+            vectorized_sentence = self.preprocessor.vectorize_sentence(sentence, doc)
+            vectorized_sentences.append(vectorized_sentence)
+            instance_refs += [(sent_idx, inst_idx) for inst_idx in range(len(vectorized_sentence))]
+
+        # Bucket instances by length (Longest --> Shortest), buckets are passed to the model already sorted
+        instance_refs.sort(key=lambda ref: len(vectorized_sentences[ref[0]][ref[1]]["sent_vec"]), reverse=True)
+        tags_lists: List[List] = [[None] * len(vectorized_sentence) for vectorized_sentence in vectorized_sentences]
+        for bucket_start in range(0, len(instance_refs), max_instances):
+            bucket_refs = instance_refs[bucket_start: bucket_start + max_instances]
+            bucket_tags = self._get_tags([vectorized_sentences[sent_idx][inst_idx] for sent_idx, inst_idx in bucket_refs])
+            for (sent_idx, inst_idx), tags in zip(bucket_refs, bucket_tags):
+                tags_lists[sent_idx][inst_idx] = tags
+
+        return [self.decoder.get_relations(doc, tags_list, vectorized_sentence) if vectorized_sentence else []
+                for doc, tags_list, vectorized_sentence in zip(docs, tags_lists, vectorized_sentences)]
+
+
+    def _get_tags(self, instances: List[Dict]) -> List[List[str]]:
+        # Decoded tags for each of vectorized instances, in a single model pass
+        sents_vec, ents_vec, pos_vec, lens_vec, mask = self.preprocessor.pad_batch(instances)
+        with torch.no_grad():
+            logits, class_probabilities = self.model(sents_vec.long(), ents_vec.long(), pos_vec.long(), lens_vec)
+        return self.decoder.decode({ "logits": logits, "class_probabilities": class_probabilities,
+                                     "mask": mask.long() })["tags"]
@@ -0,0 +1,81 @@
+"""
+Process-wide registry of spaCy pipelines, `en_core_web_sm` is loaded at most once per process and shared
+by all callers, each running only the components it requires:
+  - "tagger": POS tags (`pos_`)
+  - "parser": Dependency parse, noun chunks and sentence boundaries
+  - "ner": Named entities (`ent_type_`)
+  - "sentencizer": Rule-based sentence boundaries (Without loading `en_core_web_sm` if required alone)
+With no components, only the tokenizer is applied
+"""
+import threading
+import spacy
+from spacy.lang.en import English
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+SPACY_MODEL = "en_core_web_sm"
+COMPONENTS = ["tagger", "parser", "ner", "sentencizer"]
+# Components of (spaCy v3) pipelines required by the above, skipped if not in pipeline
+COMPONENT_DEPENDENCIES = {
+    "tagger": ["tok2vec", "attribute_ruler"], # attribute_ruler maps tags to `pos_`
+    "parser": ["tok2vec"],
+    "ner": ["tok2vec"],
+    "sentencizer": []
+}
+
+_lock = threading.Lock()
+_languages: Dict = {} # "blank" (English tokenizer only) and SPACY_MODEL, as loaded
+_pipelines: Dict = {} # Pipeline per set of components
+
+
+class Pipeline:
+    """
+    Applies selected components of a shared spaCy Language, used as with `nlp(text)` and `nlp.pipe(texts)`
+    """
+
+    def __init__(self, nlp, components: List[Tuple]):
+        self.nlp = nlp
+        self.tokenizer = nlp.tokenizer
+        self.components = components # (name, component) in pipeline order
+
+
+    def __call__(self, text: str):
+        doc = self.nlp.make_doc(text)
+        for _, component in self.components:
+            doc = component(doc)
+        return doc
+
+
+    def pipe(self, texts: Iterable[str], batch_size: int = 256) -> Iterator:
+        docs = (self.nlp.make_doc(text) for text in texts)
+        for _, component in self.components:
+            docs = component.pipe(docs, batch_size=batch_size) if hasattr(component, "pipe") else map(component, docs)
+        return docs
+
+
+def _get_language(name: str):
+    # Called with _lock held
+    if name not in _languages:
+        _languages[name] = English() if name == "blank" else spacy.load(name)
+    return _languages[name]
+
+
+def get_pipeline(*components: str) -> Pipeline:
+    """
+    Shared pipeline applying only `components` (see above), created once per process for each set of components
+    """
+    unknown = set(components) - set(COMPONENTS)
+    if unknown:
+        raise Exception("Unknown spacy components {}, expected any of {}".format(sorted(unknown), COMPONENTS))
+    key = frozenset(components)
+    with _lock:
+        if key not in _pipelines:
+            model_components = key - {"sentencizer"}
+            nlp = _get_language(SPACY_MODEL if model_components else "blank")
+            required = set(model_components)
+            for component in model_components:
+                required.update(COMPONENT_DEPENDENCIES[component])
+            selected = [(name, component) for name, component in nlp.pipeline if name in required]
+            if "sentencizer" in key and "parser" not in key: # Parser sets sentence boundaries itself
+                selected.append(("sentencizer", nlp.create_pipe("sentencizer")))
+            _pipelines[key] = Pipeline(nlp, selected)
+        return _pipelines[key]
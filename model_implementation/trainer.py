@@ -1,18 +1,49 @@
+import hashlib
+import io
+import os
+import random
 import re
+import threading
 import time
 import torch
+import torch.distributed as dist
+import torch.multiprocessing
+import numpy as np
 from pathlib import Path
-from sklearn.metrics import precision_recall_fscore_support
+from torch import Tensor
 from torch.nn.utils.rnn import pack_padded_sequence
 from typing import Tuple, Dict, List
 from model_implementation.model.decoder import Decoder
 from model_implementation.model.model import REModel
+from model_implementation.model.inference import get_inference_model
 from model_implementation.model.utils import *
 from model_implementation.data_utils import get_next_batch
+from model_implementation.data_cache import InstanceCache, compile_instances
+from model_implementation.sampler import BucketBatchSampler
+from model_implementation.batch_loader import BatchLoader
+
+TRAINING_STATE_FILE = "training_state" # Resumable training state within save_path
+
+
+def _distributed_train(rank: int, model_config: Dict, training_config: Dict):
+    """
+    Entry point of each training process for distributed data-parallel training, see `Trainer.train`
+    """
+    world_size = training_config["num_workers"]
+    dist.init_process_group("gloo",
+                            init_method="tcp://127.0.0.1:{}".format(training_config.get("master_port", 29500)),
+                            rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size)) # Split compute cores between processes
+    try:
+        trainer = Trainer(model_config, training_config, rank=rank)
+        trainer.train()
+    finally:
+        dist.destroy_process_group()
+
 
 class Trainer:
 
-    def __init__(self, model_config: Dict, training_config=None):
+    def __init__(self, model_config: Dict, training_config=None, rank: int = 0):
         """
         Arguments:
 
@@ -21,6 +52,7 @@ class Trainer:
                 -- hidden_size: LSTM hidden state
                 -- highway: Highway connections in LSTM
                 -- layers: Number of LSTM layers
+                -- jit_lstm: (Optional) Use TorchScript compiled LSTM time-step loop
                 -- weights_dir: Directory for LSTM weights
                 -- tokens_dir: Directory containing tokens.txt and embeddings
                 -- pos_dir: Directory containing pos.txt and corresponding embeddings
@@ -28,7 +60,12 @@ class Trainer:
                 -- token_embedding_dim
                 -- ne_embedding_dim
                 -- pos_embedding_dim
-                -- predict_path: Applicable only to prediction, path to trained model
+                -- predict_path: Applicable only to prediction, path to trained model, or to model save folder
+                                 to use the best model of training (as pointed to by `best_model.txt`, else
+                                 the latest `model_epoch*`)
+                                 (Loaded once and kept resident, reloaded only if the file changes)
+                -- inference_precision: (Optional) "fp32" (default), "int8" (dynamic quantization) or "bf16"
+                                        for prediction on CPU, see `model/inference.py`
 
             * Ensure token_embedding_dim + ne_embedding_dim + pos_embedding_dim = input_size
 
@@ -40,6 +77,21 @@ class Trainer:
                 -- testdata_file: Path to file containing test data
                 -- save_on_epochs: Every x number of epochs to save on
                 -- save_path: Directory of model save folder
+                -- cache_dir: (Optional) Directory for compiled instances of data files, see `data_cache.py`
+                   Following options apply only with compiled instances (see `sampler.py`):
+                -- bucket_width: (Optional) Range of instance lengths batched together
+                -- max_tokens: (Optional) Batch by number of padded tokens instead of batch_size
+                -- seed: (Optional) Seed for shuffling of training data
+                -- loader_workers: (Optional) Number of processes preparing batches, 0 to prepare in training process
+                -- prefetch_batches: (Optional) Number of batches prepared ahead of training
+                -- num_workers: (Optional) Number of local processes for distributed data-parallel training
+                   (gloo backend), each on its own shard of the data, requires cache_dir
+                -- master_port: (Optional) Port for communication between training processes
+                -- resume: (Optional) Resume from training state in save_path if present, default False
+                -- patience: (Optional) Stop after this many epochs without improvement on test set
+                -- early_stopping_metric: (Optional) "f1" (default) or "loss", test metric for best model
+
+            rank: Rank of process in distributed training, only set by `_distributed_train`
 
         """
         self.model_config = model_config
@@ -56,11 +108,23 @@ class Trainer:
         self.model = REModel(model_config).to(self.device)
         self.decoder = Decoder(self.vocab, self.labels)
 
-        if model_config["predict_path"]:
-            self.predict_path = model_config["predict_path"]
-
+        # Resident prediction model, see `_load_predict_model`
+        self.predict_path = model_config["predict_path"] if model_config["predict_path"] else None
+        self._checkpoint_stat = None # (path, mtime, size) of checkpoint file last checked
+        self._checkpoint_hash = None # Content hash of checkpoint currently loaded into prediction model
+        self._checkpoint_lock = threading.Lock()
+        self._predict_model: REModel = None # Converted to inference_precision on load
+        # Quantized and bfloat16 models are on CPU
+        self._predict_device = self.device if model_config.get("inference_precision", "fp32") == "fp32" \
+            else torch.device("cpu")
+
+        self._instance_caches: Dict = {} # Compiled instances per data file
+        self._batch_loader: BatchLoader = None # Only for duration of training
+        self.rank = rank
+        self.world_size = 1
         if training_config:
             self.training_config: Dict = training_config
+            self.world_size = training_config.get("num_workers", 1)
             self.optimizer = torch.optim.Adam(self.model.parameters(), lr=training_config["learning_rate"])
 
 
@@ -70,77 +134,215 @@ class Trainer:
         if not self.training_config:
             raise("No training configuration given")
 
-        batch_size = self.training_config["batch_size"]
-        epochs = self.training_config["epochs"]
-
-        self.print_info()
-
-        # TODO Shuffling of data and Validation Set (Currently unable to process entire file all at once)
-        for epoch in range(1, epochs + 1):
-            print("\nEpoch {}\n--------------------------------------------------".format(epoch))
+        if self.world_size > 1 and not dist.is_initialized(): # Spawn training processes
+            if not self.training_config.get("cache_dir"):
+                raise Exception("Distributed training requires compiled instances, specify cache_dir")
+            # Compile once before spawning, rather than concurrently in each process
+            self._get_instance_cache(self.training_config["traindata_file"])
+            self._get_instance_cache(self.training_config["testdata_file"])
+            torch.multiprocessing.spawn(_distributed_train, args=(self.model_config, self.training_config),
+                                        nprocs=self.world_size)
+            return
+
+        if self.rank == 0: # Only log from a single process
+            self.print_info()
+
+        seed = self.training_config.get("seed", 0)
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        training_state = self._load_training_state()
+
+        if self.world_size > 1: # Start all processes from the same weights
+            # Frozen parameters (token embeddings) are loaded identically from file by every process
+            trainable_parameters = [parameter for parameter in self.model.parameters() if parameter.requires_grad]
+            for tensor in trainable_parameters + list(self.model.buffers()):
+                dist.broadcast(tensor.data, 0)
+
+        self._batch_loader = BatchLoader(self.preprocessor,
+                                         num_workers=self.training_config.get("loader_workers", 0),
+                                         prefetch=self.training_config.get("prefetch_batches", 4),
+                                         seed=self.training_config.get("seed", 0))
+        try:
+            self._train_epochs(training_state)
+        finally:
+            self._batch_loader.close()
+
+
+    def _train_epochs(self, training_state: Dict):
+
+        # TODO Validation Set
+        for epoch in range(training_state["epoch"] + 1, self.training_config["epochs"] + 1):
+            self._print("\nEpoch {}\n--------------------------------------------------".format(epoch))
 
             start_time = time.time()
 
-            batch_num, total_loss, total_f1 = 0, 0, 0
-            for batch_tokens, batch_tags, batch_pos in get_next_batch(batch_size, self.training_config["traindata_file"]):
+            # Loss and confusion matrix are accumulated on device, only read back when logged
+            batch_num, total_loss = 0, torch.zeros(1, device=self.device)
+            confusion_matrix = self._new_confusion_matrix()
+            for model_input in self._get_batches(self.training_config["traindata_file"], shuffle=True, epoch=epoch):
+                step_ok = True
                 try:
+                    if model_input is None: # Only in distributed training, see `_get_batches`
+                        raise Exception("Batch could not be prepared")
                     self.optimizer.zero_grad() # Clear optimizer gradients
-                    model_input = self._preprocess_batch(batch_tokens, batch_tags, batch_pos)
                     output = self.model(model_input)
                     loss = output["loss"]
                     loss.backward()
-                    self.optimizer.step()
-                    # Consolidate predicted and gold labels to 1d array
-                    predicted_labels = self.decoder.decode(output)["tag_indexes"]
-                    precision, recall, f1, _ = self._get_batch_stats(batch_tags, predicted_labels)
-                    total_loss += loss.item()
-                    total_f1 += f1
-                    batch_num += 1
-
-                    elapsed_time = time.time() - start_time
-
-                    if batch_num % 100 == 0:
-                        print("\nBatch num: {} | Loss (Cumulative): {} | F1 (Cumulative): {}".format(
-                            batch_num, total_loss / batch_num, total_f1 / batch_num))
-                    else:
-                        print("Batch num: {} | Loss (Cumulative): {} | F1 (Cumulative): {} \r".format(
-                            batch_num, total_loss / batch_num, total_f1 / batch_num), end="")
-
                 except Exception as e:
                     print("\nException: {}".format(e))
+                    step_ok = False
+                if self.world_size > 1:
+                    # Processes take or skip each step together, such that gradient all-reduces always match up
+                    step_ok = self._all_steps_ok(step_ok)
+                    if step_ok:
+                        self._all_reduce_gradients()
+                if not step_ok:
+                    continue
+
+                self.optimizer.step()
+                predicted_labels = self.decoder.get_tag_indexes(output)
+                self._update_confusion_matrix(confusion_matrix, model_input["tags_vec"], predicted_labels, model_input["mask"])
+                total_loss += loss.detach()
+                batch_num += 1
+
+                if batch_num % 100 == 0:
+                    precision, recall, f1 = self._get_stats(confusion_matrix)
+                    self._print("\nBatch num: {} | Loss (Cumulative): {} | F1 (Cumulative): {}".format(
+                        batch_num, total_loss.item() / batch_num, f1))
+                else:
+                    self._print("Batch num: {} \r".format(batch_num), end="")
 
-            print("Total num batches: {} | Loss (Cumulative): {} | F1 (Cumulative): {}".format(
-                batch_num, total_loss / batch_num, total_f1 / batch_num))
+            precision, recall, f1 = self._get_stats(confusion_matrix)
+            self._print("Total num batches: {} | Loss (Cumulative): {} | Precision: {} | Recall: {} | F1: {}".format(
+                batch_num, total_loss.item() / max(batch_num, 1), precision, recall, f1))
             elapsed_time = time.time() - start_time
-            print(time.strftime("\nTime taken for epoch: %H:%M:%S", time.gmtime(elapsed_time)))
+            self._print(time.strftime("\nTime taken for epoch: %H:%M:%S", time.gmtime(elapsed_time)))
 
-            print("================= Test ==========================")
-            batch_num, test_total_loss, test_total_f1 = 0, 0, 0
-            for batch_tokens, batch_tags, batch_pos in get_next_batch(batch_size, self.training_config["testdata_file"]):
+            self._print("================= Test ==========================")
+            batch_num, test_total_loss = 0, torch.zeros(1, device=self.device)
+            test_confusion_matrix = self._new_confusion_matrix()
+            for model_input in self._get_batches(self.training_config["testdata_file"]):
                 try:
-                    model_input = self._preprocess_batch(batch_tokens, batch_tags, batch_pos)
-                    output = self.model(model_input)
+                    if model_input is None:
+                        raise Exception("Batch could not be prepared")
+                    with torch.no_grad():
+                        output = self.model(model_input)
                     loss = output["loss"]
-                    predicted_labels = self.decoder.decode(output)["tag_indexes"]
-                    precision, recall, f1, _ = self._get_batch_stats(batch_tags, predicted_labels)
-                    test_total_loss += loss.item()
-                    test_total_f1 += f1
+                    predicted_labels = self.decoder.get_tag_indexes(output)
+                    self._update_confusion_matrix(test_confusion_matrix, model_input["tags_vec"], predicted_labels, model_input["mask"])
+                    test_total_loss += loss
                     batch_num += 1
-                    print("Batch num: {} | Loss (Cumulative): {} | F1 (Cumulative): {} \r".format(
-                        batch_num, test_total_loss / batch_num, test_total_f1 / batch_num), end="")
+                    self._print("Batch num: {} \r".format(batch_num), end="")
 
                 except Exception as e:
                     print("\nException: {}".format(e))
-
-            print("Loss (Cumulative): {} | F1 (Cumulative): {}".format(
-                batch_num, test_total_loss / batch_num, test_total_f1 / batch_num))
+                    if self.world_size > 1: # Fail all processes (see `torch.multiprocessing.spawn`) rather than
+                        raise               # consolidate test results of differing data
+
+            if self.world_size > 1: # Consolidate test results of all shards
+                test_batch_num = torch.tensor([batch_num], device=self.device)
+                for tensor in [test_confusion_matrix, test_total_loss, test_batch_num]:
+                    dist.all_reduce(tensor)
+                batch_num = test_batch_num.item()
+
+            precision, recall, f1 = self._get_stats(test_confusion_matrix)
+            test_loss = test_total_loss.item() / max(batch_num, 1)
+            self._print("Loss (Cumulative): {} | Precision: {} | Recall: {} | F1: {}".format(
+                test_loss, precision, recall, f1))
+
+            # Tracking of best model on test set
+            training_state["epoch"] = epoch
+            if self.training_config.get("early_stopping_metric", "f1") == "loss":
+                improved = training_state["best_loss"] is None or test_loss < training_state["best_loss"]
+            else:
+                improved = training_state["best_f1"] is None or f1 > training_state["best_f1"]
+            if improved:
+                training_state.update({ "best_epoch": epoch, "best_f1": f1, "best_loss": test_loss,
+                                        "epochs_without_improvement": 0 })
+            else:
+                training_state["epochs_without_improvement"] += 1
 
             # Saving of model
-            # TODO: Early stopping
-            if epoch % self.training_config["save_on_epochs"] == 0: # Save trained model
-                print("\nSaving model for epoch {}".format(epoch))
-                print("========================================")
-                torch.save(self.model.state_dict(), Path.joinpath(self.training_config["save_path"], "model_epoch{}".format(epoch)))
+            if self.rank == 0:
+                if epoch % self.training_config["save_on_epochs"] == 0 or improved: # Save trained model
+                    self._print("\nSaving model for epoch {}".format(epoch))
+                    self._print("========================================")
+                    torch.save(self.model.state_dict(), Path.joinpath(self.training_config["save_path"], "model_epoch{}".format(epoch)))
+                if improved:
+                    self._save_atomic(lambda f: f.write("model_epoch{}".format(epoch).encode()), BEST_MODEL_POINTER)
+                self._save_atomic(lambda f: torch.save(self._get_training_checkpoint(training_state), f), TRAINING_STATE_FILE)
+
+            patience = self.training_config.get("patience")
+            if patience and training_state["epochs_without_improvement"] >= patience:
+                self._print("\nNo improvement for {} epochs, stopping early. Best epoch: {} | Loss: {} | F1: {}".format(
+                    patience, training_state["best_epoch"], training_state["best_loss"], training_state["best_f1"]))
+                break
+
+
+    def _get_training_checkpoint(self, training_state: Dict):
+        # Resumable training state: model, optimizer, progress and random number generator states
+        return { "model": self.model.state_dict(),
+                 "optimizer": self.optimizer.state_dict(),
+                 "training_state": dict(training_state),
+                 "rng_state": { "torch": torch.get_rng_state(),
+                                "numpy": self._get_numpy_rng_state(),
+                                "random": random.getstate() }
+                 }
+
+
+    def _get_numpy_rng_state(self):
+        # NumPy random state with keys as tensor, such that training state contains only tensors and primitives
+        algorithm, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+        return (algorithm, torch.from_numpy(keys.astype(np.int64)), position, has_gauss, cached_gaussian)
+
+
+    def _load_training_state(self):
+        """
+        Restores model, optimizer and random number generator states if resuming from a saved training state
+        Returns:
+            Training state, last completed epoch and best test results
+        """
+        training_state = { "epoch": 0, "best_epoch": None, "best_f1": None, "best_loss": None,
+                           "epochs_without_improvement": 0 }
+        state_path = Path.joinpath(self.training_config["save_path"], TRAINING_STATE_FILE)
+        if not state_path.exists():
+            return training_state
+        if not self.training_config.get("resume"):
+            self._print("Training state {} present but not resumed (resume not set), training from epoch 1".format(state_path))
+            return training_state
+
+        checkpoint = torch.load(str(state_path), map_location=self.device)
+        self.model.load_state_dict(checkpoint["model"])
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+        torch.set_rng_state(checkpoint["rng_state"]["torch"])
+        algorithm, keys, position, has_gauss, cached_gaussian = checkpoint["rng_state"]["numpy"]
+        np.random.set_state((algorithm, keys.numpy(), position, has_gauss, cached_gaussian))
+        random.setstate(checkpoint["rng_state"]["random"])
+        training_state.update(checkpoint["training_state"])
+        self._print("=================================================")
+        self._print("RESUMING training state {}".format(state_path))
+        self._print("Resuming after epoch {} | Best epoch: {} | Loss: {} | F1: {} | Epochs without improvement: {}".format(
+            training_state["epoch"], training_state["best_epoch"], training_state["best_loss"], training_state["best_f1"],
+            training_state["epochs_without_improvement"]))
+        self._print("Model, optimizer and early stopping state continue from this state, unset resume to start anew")
+        self._print("=================================================")
+        return training_state
+
+
+    def _save_atomic(self, write, file_name: str):
+        # Writes to temporary file then replaces, such that an interrupted save never leaves a partial file
+        file_path = Path.joinpath(self.training_config["save_path"], file_name)
+        temp_path = Path.joinpath(self.training_config["save_path"], file_name + ".tmp")
+        with open(str(temp_path), "wb") as f:
+            write(f)
+        os.replace(str(temp_path), str(file_path))
+
+
+    def _print(self, *args, **kwargs):
+        # Logging of training progress, from a single process in distributed training (Errors are printed by all)
+        if self.rank == 0:
+            print(*args, **kwargs)
 
 
     def print_info(self):
@@ -157,37 +359,168 @@ class Trainer:
         print("Test data path: {}".format(self.training_config["testdata_file"]))
         print("Saving on every {} epochs.".format(self.training_config["save_on_epochs"]))
         print("Model Save Path: {}".format(self.training_config["save_path"]))
+        print("Training processes: {}".format(self.world_size))
         print("=================================================")
 
 
-    def predict(self, sentence: str):
+    def predict(self, sentence: str, tokens=None):
         """
         Prediction for sentence, not applicable for training
+        Arguments:
+            sentence: Raw sentence
+            tokens: Optional spacy Doc of sentence if already tokenized (e.g. shared between extractors)
         """
         if not self.predict_path:
             raise Exception("Saved model path not specified")
 
-        self.model.train = False
-        saved_model_path = self.predict_path
-        self.model.load_state_dict(torch.load(saved_model_path, map_location=self.device))
-        vectorized_sentence = self.preprocessor.vectorize_sentence(sentence)
+        model = self._load_predict_model()
+        tokens = self.preprocessor.tokenize(sentence) if tokens is None else tokens # Tokenized once
+        vectorized_sentence = self.preprocessor.vectorize_sentence(sentence, tokens)
         if len(vectorized_sentence) == 0: # No named entities found, shortcircuit
             return []
         model_input = self._preprocess_batch_tagless(vectorized_sentence)
-        output = self.model(model_input)
+        with torch.no_grad():
+            output = model(model_input)
         output_tags = self.decoder.decode(output)["tags"]
-        # Tuples of token indexes
-        rel_tuples: List[Tuple] = self._parse_tags({
-            "tokens": self.preprocessor.tokenize(sentence), # For getting tokens with UNK tag
-            "tags_list": output_tags, # Mutiple tag ouputs possible per sentence
-            "vectorized_instances": vectorized_sentence
-            })
+        return self.decoder.get_relations(tokens, output_tags, vectorized_sentence)
 
-        rel_tuples_split = [] # Split list of relations per two entities to separate instances
-        for rel_tuple in rel_tuples:
-            rel_tuples_split += [(rel_tuple[0], relation, rel_tuple[2]) for relation in rel_tuple[1]]
 
-        return rel_tuples_split
+    def predict_batch(self, sentences: List[str], max_instances: int = 64):
+        """
+        Prediction for multiple sentences, not applicable for training
+          - Sentences are tokenized in a single spacy pipeline pass
+          - Entity pair instances of all sentences are sorted by length and split into buckets of
+            at most `max_instances`, with a single model pass per bucket
+        Returns:
+            List of relation tuples for each sentence, in order of `sentences`
+        """
+        if not self.predict_path:
+            raise Exception("Saved model path not specified")
+
+        model = self._load_predict_model() # Same model for all buckets, even if reloaded meanwhile
+        docs = self.preprocessor.tokenize_batch(sentences)
+
+        # Flatten instances of all sentences, keeping track of sentence each instance belongs to
+        vectorized_sentences: List[List[Dict]] = []
+        instance_refs: List[Tuple] = [] # (sentence index, instance index within sentence)
+        for sent_idx, (sentence, doc) in enumerate(zip(sentences, docs)):
+            vectorized_sentence = self.preprocessor.vectorize_sentence(sentence, doc)
+            vectorized_sentences.append(vectorized_sentence)
+            instance_refs += [(sent_idx, inst_idx) for inst_idx in range(len(vectorized_sentence))]
+
+        # Bucket instances by length (Longest --> Shortest) to minimize padding, buckets are passed to the model
+        # already sorted
+        instance_refs.sort(key=lambda ref: len(vectorized_sentences[ref[0]][ref[1]]["sent_vec"]), reverse=True)
+        tags_lists: List[List] = [[None] * len(vectorized_sentence) for vectorized_sentence in vectorized_sentences]
+        for bucket_start in range(0, len(instance_refs), max_instances):
+            bucket_refs = instance_refs[bucket_start: bucket_start + max_instances]
+            model_input = self._preprocess_batch_tagless(
+                [vectorized_sentences[sent_idx][inst_idx] for sent_idx, inst_idx in bucket_refs])
+            with torch.no_grad():
+                output = model(model_input)
+            for (sent_idx, inst_idx), tags in zip(bucket_refs, self.decoder.decode(output)["tags"]):
+                tags_lists[sent_idx][inst_idx] = tags
+
+        return [self.decoder.get_relations(doc, tags_list, vectorized_sentence) if vectorized_sentence else []
+                for doc, tags_list, vectorized_sentence in zip(docs, tags_lists, vectorized_sentences)]
+
+
+    def _load_predict_model(self) -> REModel:
+        """
+        Resident prediction model of saved model at `predict_path`, loaded only if not already loaded
+          - File modification time and size are checked on every call
+          - Only if these differ is the file read and hashed, reloading weights if its contents changed
+          - Weights are reloaded into a new model replacing the resident one, predictions running concurrently
+            finish on the model they started with
+          - Prediction model is converted to `inference_precision` from the loaded float32 weights
+        """
+        with self._checkpoint_lock:
+            checkpoint_path = get_checkpoint_path(self.predict_path)
+            checkpoint_stat = checkpoint_path.stat()
+            checkpoint_stat = (str(checkpoint_path), checkpoint_stat.st_mtime_ns, checkpoint_stat.st_size)
+            if checkpoint_stat == self._checkpoint_stat:
+                return self._predict_model
+
+            with open(str(checkpoint_path), "rb") as checkpoint_file:
+                checkpoint_bytes = checkpoint_file.read()
+            checkpoint_hash = hashlib.md5(checkpoint_bytes).hexdigest()
+            if not checkpoint_hash == self._checkpoint_hash:
+                state_dict = torch.load(io.BytesIO(checkpoint_bytes), map_location=self.device)
+                model = REModel(self.model_config).to(self.device)
+                model.load_state_dict(state_dict)
+                model.train = False
+                self._predict_model = get_inference_model(model, self.model_config.get("inference_precision", "fp32"))
+                self._checkpoint_hash = checkpoint_hash
+            self._checkpoint_stat = checkpoint_stat
+            return self._predict_model
+
+
+    def _get_batches(self, data_file: str, shuffle: bool = False, epoch: int = 0):
+        """
+        Batches of model input (on device) for data file
+          - If `cache_dir` is configured, read directly from compiled instances (compiled on first use)
+            and batched by length, shuffled if `shuffle` (seeded by `seed` and epoch)
+          - Otherwise parsed and vectorized from data file, in file order
+        """
+        batch_size = self.training_config["batch_size"]
+        # Batches are prepared by batch loader from batch tasks, see `batch_loader.py`
+        if self.training_config.get("cache_dir"):
+            instance_cache = self._get_instance_cache(data_file)
+            sampler = BucketBatchSampler(instance_cache.lengths, batch_size,
+                                         max_tokens=self.training_config.get("max_tokens"),
+                                         bucket_width=self.training_config.get("bucket_width", 5),
+                                         shuffle=shuffle,
+                                         seed=self.training_config.get("seed", 0))
+            batches = sampler.get_batches(epoch)
+            if self.world_size > 1:
+                # Every process takes every world_size-th batch of the same (seeded) order of batches
+                # When training, all processes are to take the same number of steps for gradient all-reduce
+                if shuffle:
+                    batches = batches[:len(batches) - len(batches) % self.world_size]
+                batches = batches[self.rank::self.world_size]
+            tasks = (("compiled", instance_cache.compiled_dir, indexes) for indexes in batches)
+        else:
+            tasks = (("raw", batch_tokens, batch_tags, batch_pos)
+                     for batch_tokens, batch_tags, batch_pos in get_next_batch(batch_size, data_file))
+        # In distributed training, batches which could not be prepared are yielded as None, such that all
+        # processes take the same number of steps (Skipped together, see `_train_epochs`)
+        for batch in self._batch_loader.iterate(tasks, skip_failed=self.world_size == 1):
+            yield self._to_device(batch) if batch is not None else None
+
+
+    def _get_instance_cache(self, data_file: str) -> InstanceCache:
+        # Compiled instances of data file, compiled on first use
+        if data_file not in self._instance_caches:
+            vocab_files = [Path.joinpath(self.model_config["tokens_dir"], "tokens.txt"),
+                           Path.joinpath(self.model_config["pos_dir"], "pos.txt"),
+                           Path.joinpath(self.model_config["labels_dir"], "labels.txt")]
+            compiled_dir = compile_instances(data_file, vocab_files, self.preprocessor, self.training_config["cache_dir"])
+            self._instance_caches[data_file] = InstanceCache(compiled_dir)
+        return self._instance_caches[data_file]
+
+
+    def _all_steps_ok(self, step_ok: bool) -> bool:
+        # Whether the step succeeded on all training processes
+        failed = torch.tensor([0 if step_ok else 1], device=self.device)
+        dist.all_reduce(failed)
+        return failed.item() == 0
+
+
+    def _all_reduce_gradients(self):
+        # Average gradients across training processes with a single all-reduce over flattened gradients
+        gradients = [parameter.grad for parameter in self.model.parameters() if parameter.grad is not None]
+        flattened = torch.cat([gradient.view(-1) for gradient in gradients])
+        dist.all_reduce(flattened)
+        flattened /= self.world_size
+        offset = 0
+        for gradient in gradients:
+            gradient.copy_(flattened[offset: offset + gradient.numel()].view_as(gradient))
+            offset += gradient.numel()
+
+
+    def _to_device(self, model_input: Dict):
+        return { key: value.to(self.device) if isinstance(value, Tensor) else value
+                 for key, value in model_input.items() }
 
 
     def _preprocess_batch_tagless(self, instances_dict):
@@ -201,11 +534,11 @@ class Trainer:
             sequence_lengths and sequence mask and tags vector (tag indexes)
         """
         sents_vec, ents_vec, pos_vec, lens_vec, mask = self.preprocessor.pad_batch(instances_dict)
-        return { "sent_vec": sents_vec.long().to(self.device),
-                 "ent_vec": ents_vec.long().to(self.device),
-                 "pos_vec": pos_vec.long().to(self.device),
+        return { "sent_vec": sents_vec.long().to(self._predict_device),
+                 "ent_vec": ents_vec.long().to(self._predict_device),
+                 "pos_vec": pos_vec.long().to(self._predict_device),
                  "lengths": lens_vec,
-                 "mask": mask.long().to(self.device)
+                 "mask": mask.long().to(self._predict_device)
                  }
 
 
@@ -220,80 +553,44 @@ class Trainer:
             Dictionary of sentence vector (token indexes), entity vector,
             sequence_lengths and sequence mask and tags vector (tag indexes)
         """
-        assert(len(tokens_list) == len(tags_list))
-        vectorized_list: List[Dict] = []
-        for i, tokens in enumerate(tokens_list):
-            tags = tags_list[i]
-            pos = pos_list[i]
-            vectorized: List[Dict] = self.preprocessor.vectorize_token_tags(tokens, tags, pos)
-            vectorized_list += vectorized
-        sents_vec, ents_vec, pos_vec, lens_vec, mask, tags_vec = self.preprocessor.pad_batch(vectorized_list)
-        return { "sent_vec": (sents_vec.long()).to(self.device),
-                 "ent_vec": ents_vec.long().to(self.device),
-                 "pos_vec": pos_vec.long().to(self.device),
-                 "lengths": lens_vec,
-                 "mask": mask.long().to(self.device),
-                 "tags_vec": tags_vec.long().to(self.device)
-                 }
+        return self._to_device(self.preprocessor.vectorize_batch(tokens_list, tags_list, pos_list))
 
 
-    def _get_batch_stats(self, batch_labels: List, predicted_labels: List):
+    def _new_confusion_matrix(self):
+        # (gold label, predicted label) counts, kept on the training device
+        return torch.zeros((self.labels.labels_len, self.labels.labels_len), dtype=torch.long, device=self.device)
+
+
+    def _update_confusion_matrix(self, confusion_matrix: Tensor, gold_labels: Tensor, predicted_labels: Tensor, mask: Tensor):
         """
-        Gets precision, recall, f1 score given tags of batch and predicted_labels
+        Adds counts of a batch to confusion matrix in place
         Arguments:
-            batch_labels: 1d List of label indexes
-            predicted_labels: 1d List of label indexes
-        Returns:
-            (Precision, Recall, F1, Support[Not applicable]) : List[int]
+            confusion_matrix: (num_labels, num_labels) Tensor
+            gold_labels: (batch_size, sequence_length) Tensor of label indexes
+            predicted_labels: (batch_size, sequence_length) Tensor of label indexes
+            mask: (batch_size, sequence_length) Tensor, 1 if index is valid for sentence else 0
         """
-        assert(len(batch_labels) == len(predicted_labels))
-        gold_labels = []
-        for single_batch_tags in batch_labels:
-            gold_labels.append([self.labels.get_index_from_word(tag) for tag in single_batch_tags])
-        gold_labels = [j for epoch in gold_labels for j in epoch]
-        predicted_labels = [j for epoch in predicted_labels for j in epoch]
-        return precision_recall_fscore_support(gold_labels, predicted_labels, average='weighted', warn_for=tuple())
+        num_labels = self.labels.labels_len
+        valid = mask > 0
+        pair_indexes = gold_labels[valid].long() * num_labels + predicted_labels[valid].long()
+        confusion_matrix += torch.bincount(pair_indexes, minlength=num_labels * num_labels).view(num_labels, num_labels)
 
 
-    def _parse_tags(self, output_dict: Dict):
+    def _get_stats(self, confusion_matrix: Tensor):
         """
-        Given a vectorized sentence (vocabulary word indexes) and output tags for the sentence,
-        generate tuples of relations
-        Arguments:
-            Dictionary containing "sent_vec": `sentence vector` and "tags_list": `list of tags`
-            Note that tags is a nested list since multiple predicates can be present in the sentence
+        Gets precision, recall, f1 score from confusion matrix, averaged over labels weighted by support
+        (As with sklearn precision_recall_fscore_support, average='weighted')
         Returns:
-            tuples: List of < ent1: str, rels: List[str], ent2: str > tuples
-              - (multiple rels possible for two entities)
+            (Precision, Recall, F1) : Tuple[float]
         """
-        tokens, tags_list, vectorized_instances = output_dict["tokens"], output_dict["tags_list"], output_dict["vectorized_instances"]
-        assert(len(tags_list) == len(vectorized_instances))
-
-        tuples: List[Tuple] = []
-        for n, vectorized_instance in enumerate(vectorized_instances):
-            ent1, rels, ent2 = "", [], ""
-            ent_vector = vectorized_instance['ent_vec']
-            tags = tags_list[n]
-            rel = ""
-            for i, token in enumerate(tokens):
-                if ent_vector[i] == 1:
-                    ent1 = " ".join([ent1, token.text]) if ent1 else token.text
-                elif ent_vector[i] == 2:
-                    ent2 = " ".join([ent2, token.text]) if ent2 else token.text
-                else:
-                    tag = tags[i]
-                    if re.search("B-", tag):
-                        if not rel == "":
-                            rels.append(rel)
-                        rel = token.text
-                    elif re.search("I-", tag):
-                        rel = " ".join([rel, token.text])
-                    else: # O tag
-                        if not rel == "":
-                            rels.append(rel)
-                        rel = ""
-            tuples.append((ent1, rels, ent2))
-        return(tuples)
+        confusion_matrix = confusion_matrix.double()
+        true_positives = confusion_matrix.diag()
+        predicted_count, support = confusion_matrix.sum(0), confusion_matrix.sum(1)
+        precision = true_positives / predicted_count.clamp(min=1)
+        recall = true_positives / support.clamp(min=1)
+        f1 = 2 * precision * recall / (precision + recall).clamp(min=1e-13)
+        weights = support / support.sum().clamp(min=1)
+        return ((precision * weights).sum().item(), (recall * weights).sum().item(), (f1 * weights).sum().item())
 
 
     def _get_phrase(self, token_indexes: List, sentence_tokens: List):
@@ -301,7 +598,7 @@ class Trainer:
         phrase = ""
         hyphen = False
         for token_index, arr_index in token_indexes:
-            word = self.vocab.idx_to_word[token_index] if token_index > 1 else sentence_tokens[arr_index].text
+            word = self.vocab.get_word_from_index(token_index) if token_index > 1 else sentence_tokens[arr_index].text
             if re.search("'", word) or re.search(",", word):
                 phrase = "".join([phrase, word])
             elif re.search("-", word):
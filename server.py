@@ -1,11 +1,14 @@
-import random
+import threading
+import time
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from flask_cors import CORS
 from flask import Flask, request, jsonify, send_file
 from pathlib import Path
 
 # Model
-from model_implementation.trainer import Trainer
+from model_implementation.serving import Predictor
+from model_implementation.model.export import is_export_current
 from main import get_model_training_config
 
 # Instance generation
@@ -13,45 +16,72 @@ from generation.allen_models import DepParse
 from generation.allen_models import OpenIE
 from generation.dependency_parse.main import generate
 from generation.oie_generate import DataGenerator
+from generation.annotation import AnnotationCache, SPACY_DOC, DEPENDENCY_TREE, NER_TOKENS, OIE_TUPLES
 
 # Database
-import sqlite3
+from data.database import Database, SENTENCE_TABLE, VALID_INSTANCES_TABLE, INVALID_INSTANCES_TABLE
 
 app = Flask(__name__)
 CORS(app)
 
 model_config, training_config = get_model_training_config(Path.joinpath(Path(__file__).parent.resolve(), 'model_implementation'))
-model_trainer = Trainer(model_config, training_config)
+# Lean runtime for exported model if configured, unless export is stale (Of other than current trained model)
+if model_config.get("serve_exported") and is_export_current(model_config["export_dir"], model_config["predict_path"]):
+    print("Serving exported model {}".format(model_config["export_dir"]))
+    model_trainer = Predictor(model_config["export_dir"])
+else:
+    if model_config.get("serve_exported"):
+        print("Exported model {} missing or not of current model {}, serving trained model".format(
+            model_config["export_dir"], model_config["predict_path"]))
+    from model_implementation.trainer import Trainer # Training runtime imported only if serving trained model
+    model_trainer = Trainer(model_config, training_config)
 oie_generator = OpenIE()
 dependency_parser = DepParse()
 ner_oie_generator = DataGenerator(use_allen = True)
 
-# TODO Refactor: Move constants
-SENTENCE_TABLE = "Sentence"
-VALID_INSTANCES_TABLE = "PositiveInstance"
-INVALID_INSTANCES_TABLE = "NegativeInstance"
-
-def quote_string(txt: str):
-    return "\"" + txt + "\""
+# Extractors of /predict/all are run concurrently, each within its timeout (seconds)
+EXTRACTOR_TIMEOUTS = {
+    "model_prediction": 30,
+    "dp_prediction": 30,
+    "ner_oie_prediction": 60
+}
+# Each extractor runs on its own workers, such that a slow extractor does not hold up the others
+# Up to one run per worker may wait for a worker, beyond that (Including timed out runs still finishing) the
+# extractor is busy and requests fail fast rather than queue behind these
+EXTRACTOR_WORKERS = {
+    "model_prediction": 2,
+    "dp_prediction": 2,
+    "ner_oie_prediction": 1 # DataGenerator keeps state of the sentence being generated
+}
+extractor_pools = { name: ThreadPoolExecutor(max_workers=workers) for name, workers in EXTRACTOR_WORKERS.items() }
+extractor_slots = { name: threading.BoundedSemaphore(2 * workers) for name, workers in EXTRACTOR_WORKERS.items() }
+
+# Analyses of a sentence are computed once and shared by extractors, kept for recently predicted sentences
+ANNOTATION_CACHE_SIZE = 1024
+annotation_cache = AnnotationCache({
+    SPACY_DOC: model_trainer.preprocessor.tokenize,
+    DEPENDENCY_TREE: dependency_parser.get_tree,
+    NER_TOKENS: ner_oie_generator.ner.get_tagged_tokens,
+    OIE_TUPLES: ner_oie_generator.open_ie.get_tuples
+}, ANNOTATION_CACHE_SIZE)
+
+# Connections are pooled and reused across requests
+database = Database()
+database.create_tables()
 
 @app.route('/db_download', methods=['GET'])
 def download_db():
     # Allow error stacktrace here, handle in frontend
-    root = Path(__file__).parent.resolve()
-    file_path = Path.joinpath(root, "data/store.db")
-    return send_file(str(file_path), as_attachment=True, cache_timeout=0)
+    database.checkpoint() # Committed changes still in WAL are written to database file
+    return send_file(database.db_file_path, as_attachment=True, cache_timeout=0)
 
 
 @app.route('/get_sentence', methods=['GET'])
 def get_sentence():
-    # Get from database a random sentence which is not yet processed
-    connection = sqlite3.connect('./data/store.db')
-    cursor = connection.cursor()
-    cursor.execute('SELECT * FROM {} WHERE processed=0 AND length(sentence)<250 and skip=0 LIMIT 15'.format(SENTENCE_TABLE))
-    sentence_rows = cursor.fetchall()
-    sentence = random.choice(sentence_rows)[0] if sentence_rows else ""
+    # Get from database a random sentence which is not yet processed, leased to this annotator
+    sentence = database.lease_sentence()
     return jsonify({
-        "sentence": sentence
+        "sentence": sentence if sentence is not None else ""
     });
 
 
@@ -61,27 +91,70 @@ def skip_sentence():
     data = request.get_json(force=True)
     sentence = data["sentence"]
     # Set sentence as skipped
-    connection = sqlite3.connect('./data/store.db')
-    cursor = connection.cursor()
-    cursor.execute("UPDATE {} SET skip=1 WHERE sentence={}".format(SENTENCE_TABLE, quote_string(sentence)))
+    with database.transaction() as connection:
+        connection.execute("UPDATE {} SET skip=1 WHERE sentence=?".format(SENTENCE_TABLE), (sentence,))
     return jsonify({
         "message": "Set skipped on sentence".format(sentence)
     });
 
 
+def predict_model(annotation):
+    return model_trainer.predict(annotation.sentence, annotation.get(SPACY_DOC))
+
+
+def predict_dp(annotation):
+    return generate(annotation.get(DEPENDENCY_TREE)) # Get tree from dependency parse first
+
+
+def predict_ner_oie(annotation):
+    generated = ner_oie_generator.generate(annotation.sentence, annotation) # Single worker, see EXTRACTOR_WORKERS
+    return generated[1] if generated else [] # Empty string if sentence contains no named entities
+
+
+EXTRACTORS = {
+    "model_prediction": predict_model,
+    "dp_prediction": predict_dp,
+    "ner_oie_prediction": predict_ner_oie
+}
+
+
+def submit_extractor(name: str, annotation):
+    # Future of extractor run on its workers, None if extractor is busy
+    if not extractor_slots[name].acquire(blocking=False):
+        return None
+    future = extractor_pools[name].submit(EXTRACTORS[name], annotation)
+    future.add_done_callback(lambda _: extractor_slots[name].release()) # Also on cancellation
+    return future
+
+
 @app.route('/predict/all', methods=['POST'])
 def predict_relations():
     data = request.get_json(force=True)
     sentence = data["sentence"]
 
-    model_prediction = model_trainer.predict(sentence)
-    dp_prediction = generate(dependency_parser.get_tree(sentence)) # Get tree from dependency parse first
-    instance, ner_oie_prediction = ner_oie_generator.generate(sentence)
-    return jsonify({
-        "model_prediction": model_prediction,
-        "dp_prediction": dp_prediction,
-        "ner_oie_prediction": ner_oie_prediction
-        })
+    # Extractors are independent, latency is that of the slowest extractor (up to its timeout)
+    start_time = time.time()
+    annotation = annotation_cache.get(sentence)
+    futures = { name: submit_extractor(name, annotation) for name in EXTRACTORS }
+    predictions, status = {}, {}
+    for name, future in futures.items():
+        if future is None:
+            predictions[name] = []
+            status[name] = "busy"
+            continue
+        try:
+            predictions[name] = future.result(timeout=max(0, start_time + EXTRACTOR_TIMEOUTS[name] - time.time()))
+            status[name] = "ok"
+        except FutureTimeoutError: # Partial results, extractor finishes in background if already started
+            future.cancel()
+            predictions[name] = []
+            status[name] = "timeout"
+        except Exception as e:
+            print("\nException: {}".format(e))
+            predictions[name] = []
+            status[name] = "error"
+    predictions["status"] = status
+    return jsonify(predictions)
 
 
 @app.route('/addinstances', methods=['POST'])
@@ -90,53 +163,25 @@ def add_instances():
     sentence = data["sentence"]
     valid_instances, invalid_instances = data["validInstances"], data["invalidInstances"]
 
-    connection = sqlite3.connect('./data/store.db')
-    cursor = connection.cursor()
-    # Create tables if they don't yet exist
-    # Arrays are not supported in SQLite3, map string keys to integer primary keys in corresponding tables
-    cursor.execute('CREATE TABLE IF NOT EXISTS {} (sentence TEXT, valid_keys STRING, invalid_keys STRING, processed INTEGER, UNIQUE(sentence))'
-                   .format(SENTENCE_TABLE))
-    cursor.execute('CREATE TABLE IF NOT EXISTS {} (entity1 TEXT, rel TEXT, entity2 TEXT)'
-                   .format(VALID_INSTANCES_TABLE))
-    cursor.execute('CREATE TABLE IF NOT EXISTS {} (entity1 TEXT, rel TEXT, entity2 TEXT)'
-                   .format(INVALID_INSTANCES_TABLE))
-
-    # Store primary keys of instances to store in sentence table
-    valid_instance_keys = []
-    invalid_instance_keys = []
-
-    # Check if sentence already exists in table
-    cursor.execute("SELECT * FROM {} WHERE sentence={}".format(SENTENCE_TABLE, quote_string(sentence)))
-    result = cursor.fetchone()
-    response = "Sentence already in table, updating" if result else "Sentence and Instances added"
-
-    # Since we are unable to store arrays with SQLite3, indexes are comma joined and stringified
-    for instance in valid_instances:
-        cursor.execute("INSERT INTO {} ({}, {}, {}) VALUES ({}, {}, {})"
-                    .format(VALID_INSTANCES_TABLE,
-                            "entity1", "rel", "entity2",
-                            quote_string(instance[0]), quote_string(instance[1]), quote_string(instance[2])))
-        valid_instance_keys.append(str(cursor.lastrowid))
-    for instance in invalid_instances:
-        cursor.execute("INSERT INTO {} ({}, {}, {}) VALUES ({}, {}, {})"
-                    .format(INVALID_INSTANCES_TABLE,
-                            "entity1", "rel", "entity2",
-                            quote_string(instance[0]), quote_string(instance[1]), quote_string(instance[2])))
-        invalid_instance_keys.append(str(cursor.lastrowid))
-
-    # Insertion or updating of sentence in Sentence Table with instance indices
-    insertion_command = "INSERT OR REPLACE INTO {} ({}, {}, {}, {}) VALUES ({}, {}, {}, {})".format(
-        SENTENCE_TABLE,
-        "sentence", "valid_keys", "invalid_keys", "processed",
-        quote_string(sentence),
-        quote_string(",".join(valid_instance_keys)),
-        quote_string(",".join(invalid_instance_keys)),
-        1)
-    cursor.execute(insertion_command)
-
-    # Save changes and close connection
-    connection.commit()
-    connection.close()
+    # Sentence and its instances are written in a single transaction
+    with database.transaction() as connection:
+        # Check if sentence already exists in table
+        result = connection.execute("SELECT id FROM {} WHERE sentence=?".format(SENTENCE_TABLE), (sentence,)).fetchone()
+        response = "Sentence already in table, updating" if result else "Sentence and Instances added"
+        if result:
+            sentence_id = result[0]
+            connection.execute("UPDATE {} SET processed=1 WHERE id=?".format(SENTENCE_TABLE), (sentence_id,))
+            # Instances of earlier annotation of sentence are replaced
+            for table in (VALID_INSTANCES_TABLE, INVALID_INSTANCES_TABLE):
+                connection.execute("DELETE FROM {} WHERE sentence_id=?".format(table), (sentence_id,))
+        else:
+            sentence_id = connection.execute("INSERT INTO {} (sentence, processed) VALUES (?, 1)".format(SENTENCE_TABLE),
+                                             (sentence,)).lastrowid
+
+        # Instances reference sentence by its id
+        for table, instances in ((VALID_INSTANCES_TABLE, valid_instances), (INVALID_INSTANCES_TABLE, invalid_instances)):
+            connection.executemany("INSERT INTO {} (sentence_id, entity1, rel, entity2) VALUES (?, ?, ?, ?)".format(table),
+                                   [(sentence_id, instance[0], instance[1], instance[2]) for instance in instances])
     return jsonify({
         "response": response
         });
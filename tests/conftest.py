@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Packages are imported from the root folder, as when run from it (e.g. `python -m data.process_data`)
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
@@ -0,0 +1,56 @@
+import threading
+import pytest
+from generation.annotation import AnnotationCache, SPACY_DOC, DEPENDENCY_TREE
+
+
+class CountingAnnotator:
+    # Annotator recording the sentences it is called for, failing on the first `failures` calls
+    def __init__(self, failures: int = 0):
+        self.calls = []
+        self.failures = failures
+
+    def __call__(self, sentence: str):
+        self.calls.append(sentence)
+        if len(self.calls) <= self.failures:
+            raise Exception("Annotator failed")
+        return [sentence]
+
+
+def test_layer_computed_once_and_shared():
+    annotators = { SPACY_DOC: CountingAnnotator(), DEPENDENCY_TREE: CountingAnnotator() }
+    cache = AnnotationCache(annotators)
+    annotation = cache.get("Bob died in London")
+    assert cache.get("Bob died in London") is annotation
+    layers = []
+    threads = [threading.Thread(target=lambda: layers.append(cache.get("Bob died in London").get(SPACY_DOC)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(layers) == 8 and all(layer is layers[0] for layer in layers)
+    assert annotators[SPACY_DOC].calls == ["Bob died in London"]
+    assert annotators[DEPENDENCY_TREE].calls == [] # Layers computed on first use only
+
+
+def test_least_recently_used_evicted():
+    annotators = { SPACY_DOC: CountingAnnotator() }
+    cache = AnnotationCache(annotators, max_size=2)
+    first = cache.get("first")
+    cache.get("second")
+    assert cache.get("first") is first # Now most recently used
+    cache.get("third") # Evicts "second"
+    assert list(cache.annotations) == ["first", "third"]
+    assert cache.get("first") is first
+    cache.get("second").get(SPACY_DOC)
+    assert list(cache.annotations) == ["first", "second"] and len(cache.annotations) == 2
+
+
+def test_failed_layer_not_cached():
+    annotators = { SPACY_DOC: CountingAnnotator(failures=1) }
+    annotation = AnnotationCache(annotators).get("Bob died in London")
+    with pytest.raises(Exception):
+        annotation.get(SPACY_DOC)
+    assert annotation.get(SPACY_DOC) == ["Bob died in London"] # Retried
+    assert annotation.get(SPACY_DOC) is annotation.get(SPACY_DOC)
+    assert len(annotators[SPACY_DOC].calls) == 2
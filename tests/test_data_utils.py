@@ -0,0 +1,56 @@
+import pytest
+from model_implementation.data_utils import stream_sentences, parse_generated_instances, parse_oie, reorder_argtags
+
+# Sentences of (word, label, pos), word_id of each row is its position within the sentence
+SENTENCES = [
+    [("Bob", "B-ENT1", "PROPN"), ("died", "B-REL", "VERB"), ("in", "I-REL", "ADP"), ("London", "B-ENT2", "PROPN")],
+    [("Erdman", "B-ENT1", "PROPN"), ("was", "O", "AUX"), ("elected", "B-REL", "VERB"), ("as", "I-REL", "ADP"),
+     ("a", "O", "DET"), ("Democrat", "B-ENT2", "PROPN"), (".", "O", "PUNCT")],
+    [("Knox", "B-ENT1", "PROPN")],
+    [("Bob", "B-ENT1", "PROPN"), ("killed", "B-REL", "VERB"), ("Conrad", "B-ENT2", "PROPN")],
+]
+
+
+@pytest.fixture
+def instance_file(tmp_path):
+    file_path = tmp_path / "instances.txt"
+    file_path.write_text("".join("{}\t{}\t{}\t{}\n".format(i, word, label, pos)
+                                 for sentence in SENTENCES for i, (word, label, pos) in enumerate(sentence)))
+    return file_path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 5, 7, 100])
+def test_sentences_carried_across_chunks(instance_file, chunk_size):
+    # Chunk boundaries within sentences (e.g. 3: second sentence spans 3 chunks), at sentence starts, and none
+    columns = ["word_id", "word", "label", "pos"]
+    sentences = list(stream_sentences(instance_file, columns, chunk_size=chunk_size, names=columns))
+    assert sentences == [[(i, word, label, pos) for i, (word, label, pos) in enumerate(sentence)]
+                         for sentence in SENTENCES] # Including last sentence of file
+
+
+def test_parse_generated_instances(instance_file):
+    assert list(parse_generated_instances(instance_file)) == [
+        ([word for word, _, _ in sentence], [label for _, label, _ in sentence], [pos for _, _, pos in sentence])
+        for sentence in SENTENCES]
+
+
+def test_parse_oie(tmp_path):
+    # Rows with empty word are dropped, ARG tags reordered and formatted to IOB-2
+    file_path = tmp_path / "oie.txt"
+    rows = [(0, "Bob", "A1-B"), (1, "", "O"), (2, "died", "P-B"), (3, "in", "A0-B"), (4, "London", "A0-I"),
+            (0, "Knox", "A0-B"), (1, "sailed", "P-B"), (2, "east", "A1-B")]
+    file_path.write_text("word_id\tword\tpred\tpred_id\thead_pred_id\tsent_id\trun_id\tlabel\n" +
+                         "".join("{}\t{}\t-\t0\t0\t0\t0\t{}\n".format(*row) for row in rows))
+    assert list(parse_oie(file_path)) == [
+        (["Bob", "died", "in", "London"], ["B-ARG0", "B-V", "B-ARG1", "I-ARG1"]),
+        (["Knox", "sailed", "east"], ["B-ARG0", "B-V", "B-ARG1"])]
+
+
+@pytest.mark.parametrize("tags, expected", [
+    (["B-ARG1", "I-ARG1", "B-V", "B-ARG0", "I-ARG0", "O"], ["B-ARG0", "I-ARG0", "B-V", "B-ARG1", "I-ARG1", "O"]),
+    (["B-ARG1", "B-V", "B-ARG0", "I-ARG0"], ["B-ARG0", "B-V", "B-ARG1", "I-ARG1"]), # I-ARG ends sentence
+    (["B-ARG1", "B-V", "B-ARG0"], ["B-ARG0", "B-V", "B-ARG1"]), # B-ARG ends sentence
+    (["O", "B-V", "B-ARG0", "I-ARG0"], ["O", "B-V", "B-ARG0", "I-ARG0"]), # Already in order
+])
+def test_reorder_argtags(tags, expected):
+    assert reorder_argtags(tags) == expected
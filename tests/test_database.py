@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+import time
+import pytest
+from data.database import Database, SENTENCE_TABLE, VALID_INSTANCES_TABLE, INVALID_INSTANCES_TABLE, MAX_SENTENCE_LENGTH
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(tmp_path / "store.db")
+    database.create_tables()
+    yield database
+    database.close()
+
+
+def add_sentences(database: Database, sentences, processed: int = 0):
+    with database.transaction() as connection:
+        connection.executemany("INSERT INTO {} (sentence, processed) VALUES (?, ?)".format(SENTENCE_TABLE),
+                               [(sentence, processed) for sentence in sentences])
+
+
+def test_lease_sentence_exclusive_under_concurrency(database):
+    sentences = ["Sentence {} with \"quotes\"".format(i) for i in range(40)]
+    add_sentences(database, sentences)
+    leased, lock = [], threading.Lock()
+
+    def lease():
+        for _ in range(5):
+            sentence = database.lease_sentence()
+            with lock:
+                leased.append(sentence)
+
+    threads = [threading.Thread(target=lease) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(leased) == sorted(sentences) # Every sentence served exactly once
+    assert database.lease_sentence() is None # All sentences leased
+
+
+def test_lease_sentence_expiry(database):
+    add_sentences(database, ["Only sentence"])
+    assert database.lease_sentence(lease_seconds=0.2) == "Only sentence"
+    assert database.lease_sentence() is None
+    time.sleep(0.3)
+    assert database.lease_sentence() == "Only sentence"
+
+
+def test_lease_sentence_queue(database):
+    add_sentences(database, ["Processed"], processed=1)
+    add_sentences(database, ["x" * MAX_SENTENCE_LENGTH, "Skipped", "Queued"])
+    with database.transaction() as connection:
+        connection.execute("UPDATE {} SET skip=1 WHERE sentence=?".format(SENTENCE_TABLE), ("Skipped",))
+
+    assert database.lease_sentence() == "Queued"
+    assert database.lease_sentence() is None
+
+
+def create_comma_joined_keys_database(db_file_path):
+    # Database of earlier schema, instances referenced by comma joined rowids in Sentence table
+    connection = sqlite3.connect(str(db_file_path))
+    connection.execute("CREATE TABLE Sentence (sentence TEXT, valid_keys STRING, invalid_keys STRING, processed INTEGER, "
+                       "UNIQUE(sentence))")
+    connection.execute("CREATE TABLE PositiveInstance (entity1 TEXT, rel TEXT, entity2 TEXT)")
+    connection.execute("CREATE TABLE NegativeInstance (entity1 TEXT, rel TEXT, entity2 TEXT)")
+    connection.executemany("INSERT INTO PositiveInstance VALUES (?, ?, ?)",
+                           [("A{}".format(i), "rel", "B{}".format(i)) for i in range(1, 6)])
+    connection.executemany("INSERT INTO NegativeInstance VALUES (?, ?, ?)", [("C", "rel", "D"), ("E", "rel", "F")])
+    connection.executemany("INSERT INTO Sentence VALUES (?, ?, ?, ?)", [
+        ("First", "1,2", "1", 1),
+        ("Second", 3, "", 1), # Single key stored as INTEGER
+        ("Unprocessed", "", "", 0)
+    ]) # PositiveInstance 4, 5 and NegativeInstance 2 are not referenced
+    connection.commit()
+    connection.close()
+
+
+def test_migration_of_comma_joined_keys(tmp_path):
+    create_comma_joined_keys_database(tmp_path / "store.db")
+    database = Database(tmp_path / "store.db")
+    database.create_tables()
+    database.create_tables() # Migrated once
+
+    columns = [row[1] for row in database.query("PRAGMA table_info({})".format(SENTENCE_TABLE))]
+    assert "valid_keys" not in columns and "invalid_keys" not in columns
+    assert database.query("SELECT id, sentence, processed FROM {} ORDER BY id".format(SENTENCE_TABLE)) == \
+        [(1, "First", 1), (2, "Second", 1), (3, "Unprocessed", 0)]
+    assert database.query("SELECT rowid, sentence_id FROM {} ORDER BY rowid".format(VALID_INSTANCES_TABLE)) == \
+        [(1, 1), (2, 1), (3, 2), (4, None), (5, None)] # Orphaned instances are kept with NULL sentence_id
+    assert database.query("SELECT rowid, sentence_id FROM {} ORDER BY rowid".format(INVALID_INSTANCES_TABLE)) == \
+        [(1, 1), (2, None)]
+    assert database.lease_sentence() == "Unprocessed" # Work queue of migrated database
+
+    # Positive instances exported by `process_db`
+    assert list(database.positive_instances()) == \
+        [("First", "A1", "rel", "B1"), ("First", "A2", "rel", "B2"), ("Second", "A3", "rel", "B3")]
+    database.close()
+
+
+def test_instances_reference_existing_sentence(database):
+    with pytest.raises(sqlite3.IntegrityError):
+        with database.transaction() as connection:
+            connection.execute("INSERT INTO {} (sentence_id, entity1, rel, entity2) VALUES (?, ?, ?, ?)"
+                               .format(VALID_INSTANCES_TABLE), (1, "A", "rel", "B"))
+
+
+def test_positive_instances(database):
+    add_sentences(database, ["Second", "First"], processed=1)
+    add_sentences(database, ["Unprocessed"])
+    ids = dict(database.query("SELECT sentence, id FROM {}".format(SENTENCE_TABLE)))
+    with database.transaction() as connection:
+        insert = "INSERT INTO {} (sentence_id, entity1, rel, entity2) VALUES (?, ?, ?, ?)"
+        connection.executemany(insert.format(VALID_INSTANCES_TABLE), [
+            (ids["First"], "A1", "rel", "B1"), (ids["Second"], "A2", "rel", "B2"), (ids["Unprocessed"], "A3", "rel", "B3"),
+            (None, "A4", "rel", "B4"), (ids["Second"], "A5", "rel", "B5")])
+        connection.execute(insert.format(INVALID_INSTANCES_TABLE), (ids["First"], "C", "rel", "D"))
+
+    # Of processed sentences only, in order of sentences
+    assert list(database.positive_instances()) == \
+        [("Second", "A2", "rel", "B2"), ("Second", "A5", "rel", "B5"), ("First", "A1", "rel", "B1")]
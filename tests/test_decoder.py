@@ -0,0 +1,62 @@
+from pathlib import Path
+import pytest
+import torch
+from model_implementation.model.decoder import Decoder
+from model_implementation.model.utils import Labels
+
+LABELS_DIR = Path.joinpath(Path(__file__).parent.parent.resolve(), "model_implementation/Custom/labels")
+
+
+@pytest.fixture
+def decoder():
+    return Decoder(None, Labels(LABELS_DIR)) # Vocabulary not used in decoding
+
+
+def make_output(decoder: Decoder, lengths, seed: int = 0):
+    generator = torch.Generator().manual_seed(seed)
+    num_labels = decoder.labels.labels_len
+    mask = (torch.arange(max(lengths)).unsqueeze(0) < torch.tensor(lengths).unsqueeze(1)).long()
+    probabilities = torch.softmax(torch.randn(len(lengths), max(lengths), num_labels, generator=generator), -1)
+    return { "class_probabilities": probabilities, "mask": mask }
+
+
+def per_sequence_paths(decoder: Decoder, output, lengths):
+    return [decoder.viterbi_decode(output["class_probabilities"][i, :length], decoder.transition_matrix)[0]
+            for i, length in enumerate(lengths)]
+
+
+@pytest.mark.parametrize("lengths", [[7, 7, 7], [12, 9, 5, 1], [1, 3, 2, 8]])
+def test_batched_viterbi_matches_per_sequence(decoder, lengths):
+    for seed in range(5):
+        output = make_output(decoder, lengths, seed)
+        paths = decoder.get_tag_indexes(output)
+        assert paths.shape == (len(lengths), max(lengths))
+        assert [paths[i, :length].tolist() for i, length in enumerate(lengths)] == \
+            per_sequence_paths(decoder, output, lengths)
+
+
+def test_decode_matches_get_tag_indexes(decoder):
+    lengths = [10, 6, 3]
+    output = make_output(decoder, lengths)
+    paths, sequence_lengths = decoder.get_tag_indexes(output, with_lengths=True)
+    assert sequence_lengths.tolist() == lengths
+
+    decoded = decoder.decode(dict(output))
+    assert decoded["tag_indexes"] == [paths[i, :length].tolist() for i, length in enumerate(lengths)]
+    assert decoded["tags"] == [[decoder.labels.get_word_from_index(index) for index in indexes]
+                               for indexes in decoded["tag_indexes"]]
+
+
+def test_decode_single_sequence(decoder):
+    output = make_output(decoder, [6])
+    single = { "class_probabilities": output["class_probabilities"][0], "mask": output["mask"][0] }
+    assert decoder.decode(single)["tag_indexes"] == per_sequence_paths(decoder, output, [6])
+
+
+def test_decoded_tags_respect_transitions(decoder):
+    # No I-tag following other than its B-tag or the same I-tag (No constraint on first tag)
+    output = make_output(decoder, [20] * 8)
+    for tags in decoder.decode(output)["tags"]:
+        for previous_tag, tag in zip(tags[:-1], tags[1:]):
+            if tag.startswith("I"):
+                assert previous_tag in (tag, "B" + tag[1:])
@@ -0,0 +1,37 @@
+import socket
+from types import SimpleNamespace
+import torch
+import torch.distributed as dist
+import torch.multiprocessing
+from model_implementation.trainer import Trainer
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_steps(rank: int, world_size: int, port: int, results):
+    dist.init_process_group("gloo", init_method="tcp://127.0.0.1:{}".format(port), rank=rank, world_size=world_size)
+    try:
+        model = torch.nn.Linear(2, 1)
+        trainer = SimpleNamespace(device=torch.device("cpu"), world_size=world_size, model=model) # Trainer state used
+        # Step failing on rank 1 only is skipped by all processes, steps succeeding everywhere are taken
+        step_ok = [Trainer._all_steps_ok(trainer, not (rank == 1 and step == 1)) for step in range(3)]
+        for parameter in model.parameters():
+            parameter.grad = torch.full_like(parameter, float(rank + 1))
+        Trainer._all_reduce_gradients(trainer)
+        results[rank] = (step_ok, [parameter.grad.tolist() for parameter in model.parameters()])
+    finally:
+        dist.destroy_process_group()
+
+
+def test_processes_skip_failed_steps_together_and_average_gradients():
+    world_size = 2
+    results = torch.multiprocessing.Manager().dict()
+    torch.multiprocessing.spawn(run_steps, args=(world_size, free_port(), results), nprocs=world_size)
+    for rank in range(world_size):
+        step_ok, gradients = results[rank]
+        assert step_ok == [True, False, True]
+        assert gradients == [[[1.5, 1.5]], [1.5]] # Mean of 1 and 2
@@ -0,0 +1,31 @@
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+import torch
+from model_implementation.model.utils import Labels
+from model_implementation.trainer import Trainer
+
+precision_recall_fscore_support = pytest.importorskip("sklearn.metrics").precision_recall_fscore_support
+IMPL_ROOT = Path.joinpath(Path(__file__).parent.parent.resolve(), "model_implementation")
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_confusion_matrix_stats_match_sklearn(seed):
+    trainer = SimpleNamespace(labels=Labels(IMPL_ROOT / "Custom/labels"), device=torch.device("cpu")) # Trainer state used
+    num_labels = trainer.labels.labels_len
+    generator = torch.Generator().manual_seed(seed)
+    confusion_matrix = Trainer._new_confusion_matrix(trainer)
+    all_gold, all_predicted = [], []
+    for _ in range(3): # Accumulated over batches
+        gold = torch.randint(0, num_labels, (4, 12), generator=generator)
+        # Mostly correct predictions, some labels never predicted / never gold
+        predicted = torch.where(torch.rand(4, 12, generator=generator) < 0.6, gold,
+                                torch.randint(0, num_labels - 1, (4, 12), generator=generator))
+        lengths = torch.randint(1, 13, (4,), generator=generator)
+        mask = (torch.arange(12).unsqueeze(0) < lengths.unsqueeze(1)).long()
+        Trainer._update_confusion_matrix(trainer, confusion_matrix, gold, predicted, mask)
+        all_gold += gold[mask > 0].tolist()
+        all_predicted += predicted[mask > 0].tolist()
+
+    expected = precision_recall_fscore_support(all_gold, all_predicted, average="weighted", zero_division=0)[:3]
+    assert Trainer._get_stats(trainer, confusion_matrix) == pytest.approx(expected)
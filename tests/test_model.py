@@ -0,0 +1,208 @@
+import os
+import numpy as np
+from pathlib import Path
+from typing import List
+import pytest
+import torch
+from model_implementation.model.model import REModel
+from model_implementation.model.utils import Vocabulary, Labels, POS
+
+IMPL_ROOT = Path.joinpath(Path(__file__).parent.parent.resolve(), "model_implementation")
+WORDS = ["the", "bob", "died", "in", "london", "a", "of", "is", "was", "member"]
+
+
+@pytest.fixture
+def model_config(tmp_path):
+    # Small model with random token embeddings for words of WORDS
+    tokens_dir = tmp_path / "tokens"
+    tokens_dir.mkdir()
+    (tokens_dir / "tokens.txt").write_text("\n".join(WORDS) + "\n")
+    torch.save(torch.randn(len(WORDS) + 2, 16, generator=torch.Generator().manual_seed(0)), tokens_dir / "token_embedder")
+    config = { "input_size": 24, "hidden_size": 8, "highway": True, "dropout": 0.0, "layers": 2,
+               "weights_dir": None, "tokens_dir": tokens_dir, "pos_dir": IMPL_ROOT / "Custom/pos",
+               "labels_dir": IMPL_ROOT / "Custom/labels", "token_embedding_dim": 16, "ne_embedding_dim": 4,
+               "pos_embedding_dim": 4, "predict_path": None }
+    config["num_tokens"] = Vocabulary(tokens_dir).vocab_len
+    config["num_classes"] = Labels(config["labels_dir"]).labels_len
+    config["num_pos"] = POS(config["pos_dir"]).pos_len
+    return config
+
+
+@pytest.fixture
+def model(model_config):
+    torch.manual_seed(0)
+    model = REModel(model_config)
+    model.train = False
+    return model
+
+
+def make_batch(model_config, lengths: List[int], seed: int = 0):
+    generator = torch.Generator().manual_seed(seed)
+    batch_size, max_length = len(lengths), max(lengths)
+    mask = (torch.arange(max_length).unsqueeze(0) < torch.tensor(lengths).unsqueeze(1)).long()
+    return { "sent_vec": torch.randint(2, model_config["num_tokens"], (batch_size, max_length), generator=generator) * mask,
+             "ent_vec": torch.randint(0, 3, (batch_size, max_length), generator=generator) * mask,
+             "pos_vec": torch.randint(0, model_config["num_pos"], (batch_size, max_length), generator=generator) * mask,
+             "lengths": list(lengths),
+             "mask": mask }
+
+
+def test_predict_model_reloaded_only_on_checkpoint_change(model_config, tmp_path):
+    from model_implementation.trainer import Trainer
+    checkpoint_path = tmp_path / "model_epoch1"
+    torch.manual_seed(1)
+    torch.save(REModel(model_config).state_dict(), checkpoint_path)
+    trainer = Trainer(dict(model_config, predict_path=checkpoint_path))
+    batch = make_batch(model_config, [5, 3])
+
+    loaded_model = trainer._load_predict_model()
+    loaded_hash = trainer._checkpoint_hash
+    with torch.no_grad():
+        probabilities = loaded_model(batch)["class_probabilities"]
+    os.utime(str(checkpoint_path)) # Touched, same contents: not reloaded
+    assert trainer._load_predict_model() is loaded_model
+    assert trainer._checkpoint_hash == loaded_hash
+
+    torch.manual_seed(2)
+    torch.save(REModel(model_config).state_dict(), checkpoint_path)
+    reloaded_model = trainer._load_predict_model()
+    assert trainer._checkpoint_hash != loaded_hash
+    with torch.no_grad():
+        assert not torch.allclose(reloaded_model(batch)["class_probabilities"], probabilities)
+        # Model in use before reload (e.g. by a concurrent prediction) is left unchanged
+        assert torch.equal(loaded_model(batch)["class_probabilities"], probabilities)
+
+
+class Token:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def vectorize_sentence(trainer, sentence: str, tokens):
+    # Deterministic entity pair instances of sentence, in place of spacy named entities
+    rng = np.random.RandomState(len(sentence))
+    sent_vec = trainer.vocab.encode([token.text for token in tokens])
+    return [{ "sent_vec": sent_vec, "ent_vec": rng.randint(0, 3, len(tokens)), "pos_vec": rng.randint(0, 10, len(tokens)) }
+            for _ in range(rng.randint(0, 4))]
+
+
+def test_predict_batch_matches_predict(model_config, model, tmp_path, monkeypatch):
+    from model_implementation.trainer import Trainer
+    torch.save(model.state_dict(), tmp_path / "model_epoch1")
+    trainer = Trainer(dict(model_config, predict_path=tmp_path / "model_epoch1"))
+    monkeypatch.setattr(trainer.preprocessor, "tokenize", lambda sentence: [Token(word) for word in sentence.split()])
+    monkeypatch.setattr(trainer.preprocessor, "tokenize_batch",
+                        lambda sentences: [trainer.preprocessor.tokenize(sentence) for sentence in sentences])
+    monkeypatch.setattr(trainer.preprocessor, "vectorize_sentence",
+                        lambda sentence, tokens: vectorize_sentence(trainer, sentence, tokens))
+
+    rng = np.random.RandomState(0)
+    sentences = [" ".join(rng.choice(WORDS, rng.randint(2, 15))) for _ in range(20)]
+    assert trainer.predict_batch(sentences, max_instances=4) == [trainer.predict(sentence) for sentence in sentences]
+
+
+@pytest.mark.parametrize("lengths", [[9, 6, 6, 2], [3, 9, 1, 6]])
+def test_scripted_recurrence_matches_python(model_config, model, lengths):
+    batch = make_batch(model_config, lengths)
+    with torch.no_grad():
+        expected = model(batch)["logits"]
+        for layer in model.lstm_layers:
+            layer.jit = True
+        scripted = model(batch)["logits"]
+    assert torch.allclose(scripted, expected, atol=1e-5)
+
+
+def test_padding_does_not_affect_outputs(model_config, model):
+    # Sequences kept padded between LSTM layers: each sequence of a batch gives the outputs it gives alone
+    lengths = [4, 9, 1, 6]
+    batch = make_batch(model_config, lengths)
+    with torch.no_grad():
+        batch_logits = model(batch)["logits"]
+        for i, length in enumerate(lengths):
+            single = { key: value[i: i + 1, :length] if torch.is_tensor(value) else [length]
+                       for key, value in batch.items() }
+            assert torch.allclose(batch_logits[i, :length], model(single)["logits"][0], atol=1e-5)
+
+
+@pytest.mark.parametrize("precision", ["int8", "bf16"])
+def test_reduced_precision_close_to_fp32(model_config, model, precision):
+    from model_implementation.model.inference import get_inference_model
+    batch = make_batch(model_config, [9, 6, 2])
+    state = { name: value.clone() for name, value in model.state_dict().items() }
+    with torch.no_grad():
+        expected = model(batch)["class_probabilities"]
+        probabilities = get_inference_model(model, precision)(batch)["class_probabilities"]
+        assert (probabilities - expected).abs().max() < 0.05
+        # Original model left unchanged
+        assert all(torch.equal(value, state[name]) for name, value in model.state_dict().items())
+        assert torch.equal(model(batch)["class_probabilities"], expected)
+
+
+def test_exported_model_matches_model(model_config, model, tmp_path):
+    from model_implementation.model.decoder import Decoder
+    from model_implementation.model.export import export_model
+    from model_implementation.serving import Predictor
+    checkpoint_path = tmp_path / "model_epoch1"
+    torch.save(model.state_dict(), checkpoint_path)
+    export_dir = tmp_path / "export"
+    export_model(model, model_config, export_dir, checkpoint_path=checkpoint_path)
+
+    lengths = [3, 9, 1, 6] # Unsorted, as with instances of a single sentence
+    batch = make_batch(model_config, lengths)
+    instances = [{ key: batch[key][i, :length].numpy() for key in ["sent_vec", "ent_vec", "pos_vec"] }
+                 for i, length in enumerate(lengths)]
+    with torch.no_grad():
+        expected = Decoder(None, Labels(model_config["labels_dir"])).decode(model(batch))["tags"]
+    assert Predictor(export_dir)._get_tags(instances) == expected
+
+
+def test_export_current(model_config, model, tmp_path):
+    from model_implementation.model.export import export_model, is_export_current
+    save_dir, export_dir = tmp_path / "saved", tmp_path / "export"
+    save_dir.mkdir()
+    assert not is_export_current(export_dir, save_dir) # No export
+    torch.save(model.state_dict(), save_dir / "model_epoch1")
+    export_model(model, model_config, export_dir, checkpoint_path=save_dir / "model_epoch1")
+    assert is_export_current(export_dir, save_dir)
+    os.utime(str(save_dir / "model_epoch1"), ns=(0, 0)) # Touched, same contents
+    assert is_export_current(export_dir, save_dir)
+
+    torch.manual_seed(1)
+    torch.save(REModel(model_config).state_dict(), save_dir / "model_epoch2") # Trained further: export is stale
+    assert not is_export_current(export_dir, save_dir)
+    # Export is self-contained, served without checkpoints
+    assert is_export_current(export_dir, tmp_path / "missing")
+    assert is_export_current(export_dir, tmp_path / "missing" / "model_epoch1")
+
+
+def test_checkpoint_path_of_save_folder(tmp_path):
+    from model_implementation.model.utils import get_checkpoint_path
+    with pytest.raises(Exception, match="No saved model"):
+        get_checkpoint_path(tmp_path)
+    for epoch in [5, 10, 15]:
+        (tmp_path / "model_epoch{}".format(epoch)).write_bytes(b"")
+    assert get_checkpoint_path(tmp_path) == tmp_path / "model_epoch15" # Latest epoch, saved without pointer
+    (tmp_path / "best_model.txt").write_text("model_epoch10")
+    assert get_checkpoint_path(tmp_path) == tmp_path / "model_epoch10"
+    assert get_checkpoint_path(tmp_path / "model_epoch5") == tmp_path / "model_epoch5"
+
+
+def test_token_embeddings_reconverted_on_change(model_config):
+    tokens_dir = model_config["tokens_dir"]
+    weights = REModel(model_config).token_embedding.weight
+    assert (tokens_dir / "token_embedder.npy").exists()
+    assert torch.equal(weights, torch.load(tokens_dir / "token_embedder"))
+    torch.save(torch.ones(len(WORDS) + 2, 16), tokens_dir / "token_embedder") # Embeddings replaced
+    assert torch.equal(REModel(model_config).token_embedding.weight, torch.ones(len(WORDS) + 2, 16))
+    (tokens_dir / "token_embedder").unlink() # Deployed with converted weights only
+    assert torch.equal(REModel(model_config).token_embedding.weight, torch.ones(len(WORDS) + 2, 16))
+
+
+def test_recurrence_not_scripted_on_import():
+    import subprocess
+    import sys
+    code = ("import warnings; warnings.simplefilter('error', FutureWarning)\n"
+            "import model_implementation.model.model, model_implementation.model.export, model_implementation.serving\n"
+            "from model_implementation.model import h_d_lstm\n"
+            "assert h_d_lstm._scripted_recurrence is None")
+    subprocess.run([sys.executable, "-c", code], cwd=str(IMPL_ROOT.parent), check=True)
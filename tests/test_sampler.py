@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from model_implementation.sampler import BucketBatchSampler
+
+LENGTHS = np.random.RandomState(0).randint(1, 60, 500).tolist()
+
+
+def check_batches(sampler: BucketBatchSampler, batches):
+    # Each instance exactly once, batches within a bucket and ordered by decreasing length
+    assert sorted(index for batch in batches for index in batch) == list(range(len(sampler.lengths)))
+    for batch in batches:
+        lengths = [sampler.lengths[index] for index in batch]
+        assert lengths == sorted(lengths, reverse=True)
+        assert len({length // sampler.bucket_width for length in lengths}) == 1
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+@pytest.mark.parametrize("batch_size, bucket_width", [(1, 5), (8, 5), (32, 1), (1000, 10)])
+def test_batches_of_batch_size(shuffle, batch_size, bucket_width):
+    sampler = BucketBatchSampler(LENGTHS, batch_size, bucket_width=bucket_width, shuffle=shuffle)
+    batches = sampler.get_batches()
+    check_batches(sampler, batches)
+    assert all(len(batch) <= batch_size for batch in batches)
+    if not shuffle: # Ordered by bucket
+        buckets = [sampler.lengths[batch[0]] // bucket_width for batch in batches]
+        assert buckets == sorted(buckets)
+
+
+@pytest.mark.parametrize("max_tokens", [30, 100, 400])
+def test_batches_of_max_tokens(max_tokens):
+    sampler = BucketBatchSampler(LENGTHS, 8, max_tokens=max_tokens)
+    batches = sampler.get_batches()
+    check_batches(sampler, batches)
+    for batch in batches:
+        # Padded tokens within limit, unless a single instance is longer than the limit
+        assert len(batch) * max(sampler.lengths[batch]) <= max_tokens or len(batch) == 1
+    if max_tokens >= 100:
+        assert any(len(batch) > 8 for batch in batches) # batch_size ignored
+
+
+def test_shuffle_reproducible_per_seed_and_epoch():
+    sampler = BucketBatchSampler(LENGTHS, 8, seed=3)
+    assert sampler.get_batches(epoch=1) == BucketBatchSampler(LENGTHS, 8, seed=3).get_batches(epoch=1)
+    assert sampler.get_batches(epoch=1) != sampler.get_batches(epoch=2)
+    assert sampler.get_batches(epoch=1) != BucketBatchSampler(LENGTHS, 8, seed=4).get_batches(epoch=1)
@@ -0,0 +1,103 @@
+import os
+from pathlib import Path
+import numpy as np
+import pytest
+from model_implementation.model.utils import Vocabulary, Labels, POS, Preprocessor, Constants, COMPILED_VOCABULARY
+from model_implementation.data_cache import compile_instances
+
+IMPL_ROOT = Path.joinpath(Path(__file__).parent.parent.resolve(), "model_implementation")
+WORDS = ["the", "London", "b", "ab", "a", "the", "Zürich", "東京", "naïve", "", "a b"] # Duplicate "the"
+QUERIES = ["the", "London", "london", "a", "ab", "abc", "Zürich", "Zurich", "東京", "東", "naïve",
+           "a b", "a", "supercalifragilisticexpialidocious", "Londonderry", "th", "", Constants.PADDING]
+
+
+def write_tokens(tokens_dir: Path, words):
+    tokens_dir.mkdir(exist_ok=True)
+    (tokens_dir / "tokens.txt").write_text("".join(word + "\n" for word in words), encoding="utf-8")
+
+
+def text_vocabulary(tokens_dir: Path) -> Vocabulary:
+    # Vocabulary read from tokens.txt, looked up by dictionary
+    vocab = Vocabulary(tokens_dir)
+    vocab.word_to_idx
+    return vocab
+
+
+@pytest.fixture
+def tokens_dir(tmp_path):
+    write_tokens(tmp_path / "tokens", WORDS)
+    return tmp_path / "tokens"
+
+
+def test_compiled_lookups_match_dictionary(tokens_dir):
+    Vocabulary(tokens_dir) # Compiles
+    assert Path.joinpath(tokens_dir, COMPILED_VOCABULARY + ".words.npy").exists()
+    compiled, text = Vocabulary(tokens_dir), text_vocabulary(tokens_dir)
+    assert compiled._words is not None and text._words is None
+    assert compiled.vocab_len == text.vocab_len == len(WORDS) + 1 # Padding and Unknown, duplicate once
+    assert compiled.encode(QUERIES).tolist() == text.encode(QUERIES).tolist()
+    assert [compiled.get_index_from_word(word) for word in QUERIES] == text.encode(QUERIES).tolist()
+    assert compiled.get_index_from_word("the") == 2 # First occurrence
+    assert compiled.get_index_from_word("supercalifragilisticexpialidocious") == Constants.UNK_INDEX
+    assert [compiled.get_word_from_index(i) for i in range(compiled.vocab_len)] == text.idx_to_word
+    assert compiled.encode([]).tolist() == []
+
+
+def test_stale_compiled_vocabulary_rebuilt(tokens_dir):
+    Vocabulary(tokens_dir)
+    write_tokens(tokens_dir, WORDS + ["Bosnia"])
+    vocab = Vocabulary(tokens_dir)
+    assert vocab.get_index_from_word("Bosnia") == vocab.vocab_len - 1
+    # Same size, only modification time differs
+    write_tokens(tokens_dir, ["xy" if word == "ab" else word for word in WORDS + ["Bosnia"]])
+    stat = (tokens_dir / "tokens.txt").stat()
+    os.utime(str(tokens_dir / "tokens.txt"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    vocab = Vocabulary(tokens_dir)
+    assert vocab.get_index_from_word("xy") == 5 and vocab.get_index_from_word("ab") == Constants.UNK_INDEX
+    assert vocab.encode(QUERIES).tolist() == text_vocabulary(tokens_dir).encode(QUERIES).tolist()
+
+
+def test_non_string_words_rejected(tokens_dir):
+    Vocabulary(tokens_dir)
+    for vocab in [Vocabulary(tokens_dir), text_vocabulary(tokens_dir)]:
+        with pytest.raises(AssertionError):
+            vocab.encode(["the", float("nan")])
+        with pytest.raises(AssertionError):
+            vocab.get_index_from_word(float("nan"))
+
+
+def test_compile_skips_instances_with_non_string_tokens(tokens_dir, tmp_path):
+    # "NA" is read as NaN by pandas
+    data_file = tmp_path / "instances.txt"
+    data_file.write_text("0\tthe\tB-ENT1\tDET\n1\tNA\tB-REL\tNOUN\n2\tLondon\tB-ENT2\tPROPN\n"
+                         "0\tthe\tB-ENT1\tDET\n1\ta\tB-REL\tDET\n2\tLondon\tB-ENT2\tPROPN\n")
+    vocab_files = [tokens_dir / "tokens.txt", IMPL_ROOT / "Custom/pos/pos.txt", IMPL_ROOT / "Custom/labels/labels.txt"]
+    preprocessor = Preprocessor(Vocabulary(tokens_dir), Labels(IMPL_ROOT / "Custom/labels"), POS(IMPL_ROOT / "Custom/pos"))
+    compiled_dir = compile_instances(str(data_file), vocab_files, preprocessor, tmp_path / "cache")
+    offsets = np.load(str(compiled_dir / "offsets.npy"))
+    tokens = np.load(str(compiled_dir / "tokens.npy"))
+    assert offsets.tolist() == [0, 3]
+    assert tokens.tolist() == preprocessor.vocab.encode(["the", "a", "London"]).tolist()
+
+
+def test_prune_vocabulary(tokens_dir, tmp_path):
+    import torch
+    from collections import Counter
+    from data.database import Database
+    from model_implementation.prune_vocabulary import count_tokens, prune_vocabulary
+    torch.save(torch.arange(len(WORDS) + 1, dtype=torch.float32).unsqueeze(1).repeat(1, 4), tokens_dir / "token_embedder")
+    database = Database(tmp_path / "store.db")
+    database.create_tables()
+    with database.transaction() as connection:
+        connection.executemany("INSERT INTO Sentence (sentence, processed) VALUES (?, 0)",
+                               [("London is naïve.",), ("the London b",)])
+    database.close()
+    token_counts = count_tokens([], str(tmp_path / "store.db"))
+    assert token_counts == Counter({ "London": 2, "is": 1, "naïve": 1, ".": 1, "the": 1, "b": 1 })
+
+    prune_vocabulary(tokens_dir, tmp_path / "pruned", token_counts + Counter({ "東京": 5 }), top_k=3, min_count=1)
+    pruned = Vocabulary(tmp_path / "pruned")
+    assert pruned.idx_to_word == [Constants.PADDING, Constants.UNKNOWN, "the", "London", "東京"] # Original order
+    original = text_vocabulary(tokens_dir)
+    weights = torch.load(tmp_path / "pruned" / "token_embedder")
+    assert weights[:, 0].tolist() == [0, 1] + [original.get_index_from_word(word) for word in ["the", "London", "東京"]]